@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import resource
+from threading import Thread, Lock
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import telegram
+from web3 import Web3
+
+from hex_info import HexInfo
+from hex_snapshot import SnapshotCache
+from hex_checker_telegram_bot import Bot
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+	# keep connections alive as web3 and telegram clients reuse them
+	protocol_version = "HTTP/1.1"
+	# headers and body are written separately: avoid delayed acknowledgments latency
+	disable_nagle_algorithm = True
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		time.sleep(self.server.owner.latency)
+		response = json.dumps(self.server.owner.handle(self.path, body)).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(response)))
+		self.end_headers()
+		self.wfile.write(response)
+
+	def log_message(self, *_):
+		pass
+
+
+class _HttpServer(ThreadingHTTPServer):
+	daemon_threads = True
+	# accept bursts of concurrent connections
+	request_queue_size = 1024
+
+
+class _FakeServer:
+	# subclasses answer every request with their handle(path, body) json response
+	def __init__(self, latency):
+		self.latency = latency
+		self.calls = Counter()
+		self.response_bytes = Counter()
+		self._lock = Lock()
+		self._server = _HttpServer(("127.0.0.1", 0), _JsonHandler)
+		self._server.owner = self
+
+	@property
+	def url(self):
+		return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+	def start(self):
+		Thread(target=self._server.serve_forever, daemon=True).start()
+		return self
+
+	def stop(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+	def reset_counters(self):
+		with self._lock:
+			self.calls.clear()
+			self.response_bytes.clear()
+
+	def _count(self, name, response):
+		with self._lock:
+			self.calls[name] += 1
+			self.response_bytes[name] += len(json.dumps(response))
+
+
+class FakeEthereumNode(_FakeServer):
+	# answers Hex contract reads with recorded responses or synthetic data
+	def __init__(self, latency, history_days, recorded_responses=None, block_time=12, seed=0):
+		super().__init__(latency)
+		self.history_days = history_days
+		self.recorded_responses = recorded_responses or {}
+		self.block_time = block_time
+		self.started_at = time.time()
+		self.codec = Web3().codec
+		random_generator = random.Random(seed)
+		self.lobby_sizes = [random_generator.randint(500, 20000) * 10 ** 18 for _ in range(history_days + 1)]
+		self._functions = {
+			bytes(Web3.keccak(text=signature)[:4]): (name, input_types, handler)
+			for signature, name, input_types, handler in [
+				("globalInfo()", "globalInfo", [], self._global_info),
+				("currentDay()", "currentDay", [], self._current_day),
+				("xfLobbyRange(uint256,uint256)", "xfLobbyRange", ["uint256", "uint256"], self._xf_lobby_range),
+				("stakeCount(address)", "stakeCount", ["address"], self._stake_count),
+				("stakeLists(address,uint256)", "stakeLists", ["address", "uint256"], self._stake_lists),
+			]
+		}
+		self._aggregate_selector = bytes(Web3.keccak(text="aggregate((address,bytes)[])")[:4])
+
+	def handle(self, path, body):
+		request = json.loads(body)
+		if isinstance(request, list):
+			return [self._handle_request(item) for item in request]
+		return self._handle_request(request)
+
+	def _handle_request(self, request):
+		method, params = request["method"], request.get("params", [])
+		key = f"{method} {json.dumps(params, sort_keys=True)}"
+		if key in self.recorded_responses:
+			result = self.recorded_responses[key]
+		elif method == "eth_blockNumber":
+			result = hex(self._get_block_number())
+		elif method == "eth_chainId" or method == "net_version":
+			result = "0x1" if method == "eth_chainId" else "1"
+		elif method == "eth_call":
+			result = self._call(params[0])
+		else:
+			return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": f"{method} not supported"}}
+		response = {"jsonrpc": "2.0", "id": request["id"], "result": result}
+		self._count(method, response)
+		return response
+
+	def _get_block_number(self):
+		return 10000000 + int((time.time() - self.started_at) / self.block_time)
+
+	def _call(self, transaction):
+		data = bytes.fromhex(transaction["data"][2:])
+		if data[:4] == self._aggregate_selector:
+			calls, = self.codec.decode_abi(["(address,bytes)[]"], data[4:])
+			return_data = [self._call_function(call_data) for _, call_data in calls]
+			encoded = self.codec.encode_abi(["uint256", "bytes[]"], [self._get_block_number(), return_data])
+		else:
+			encoded = self._call_function(data)
+		return "0x" + encoded.hex()
+
+	def _call_function(self, call_data):
+		name, input_types, handler = self._functions[bytes(call_data[:4])]
+		with self._lock:
+			self.calls[name] += 1
+		output_types, values = handler(*self.codec.decode_abi(input_types, call_data[4:]))
+		return self.codec.encode_abi(output_types, values)
+
+	def _global_info(self):
+		return ["uint256[13]"], [[
+			10 ** 18, 10 ** 18, 10 ** 5, 0, self.history_days, 10 ** 20, 100000, 0, 0, 0, int(time.time()),
+			5 * 10 ** 18, self.lobby_sizes[self.history_days]
+		]]
+
+	def _current_day(self):
+		return ["uint256"], [self.history_days]
+
+	def _xf_lobby_range(self, begin_day, end_day):
+		return ["uint256[]"], [self.lobby_sizes[begin_day:end_day]]
+
+	def _stake_count(self, address):
+		return ["uint256"], [int(address[-2:], 16)]
+
+	def _stake_lists(self, address, index):
+		return ["uint40", "uint72", "uint72", "uint16", "uint16", "uint16", "bool"], \
+			[int(address[-6:], 16) * 1000 + index, 10 ** 12, 10 ** 13, 100, 365, 0, False]
+
+
+class FakeTelegramServer(_FakeServer):
+	TOKEN = "123456:benchmark"
+
+	def handle(self, path, body):
+		method = path.rsplit("/", 1)[-1]
+		if method == "getMe":
+			result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+		elif method == "getUpdates":
+			result = []
+		else:
+			params = json.loads(body) if body else {}
+			result = {"message_id": 1, "date": int(time.time()), "text": params.get("text", ""),
+					  "chat": {"id": params.get("chat_id", 1), "type": "private"}}
+		response = {"ok": True, "result": result}
+		self._count(method, response)
+		return response
+
+
+def _get_percentiles(durations):
+	durations = sorted(durations)
+	return {
+		f"p{percentile}": round(durations[min(len(durations) - 1, int(len(durations) * percentile / 100))] * 1000, 3)
+		for percentile in (50, 90, 99)
+	}
+
+
+def _benchmark_refresh(hex_info, node, refreshes):
+	node.reset_counters()
+	started_at = time.perf_counter()
+	hex_info.refresh_data()
+	cold_refresh = time.perf_counter() - started_at
+	cold_calls = dict(node.calls)
+	node.reset_counters()
+	durations = []
+	for _ in range(refreshes):
+		started_at = time.perf_counter()
+		hex_info.refresh_data()
+		durations.append(time.perf_counter() - started_at)
+	return {
+		"cold_refresh_ms": round(cold_refresh * 1000, 3),
+		"cold_refresh_rpc_calls": cold_calls,
+		"refresh_latency_ms": _get_percentiles(durations),
+		"rpc_calls_per_refresh": {name: count / refreshes for name, count in node.calls.items()},
+		"rpc_bytes_per_refresh": {name: size / refreshes for name, size in node.response_bytes.items()},
+	}
+
+
+def _benchmark_rendering(snapshot, renders):
+	started_at = time.perf_counter()
+	for _ in range(renders):
+		Bot._render_info_message(snapshot)
+	rendering = (time.perf_counter() - started_at) / renders
+	started_at = time.perf_counter()
+	for _ in range(renders):
+		Bot._get_info_message(snapshot)
+	cached = (time.perf_counter() - started_at) / renders
+	return {"render_us": round(rendering * 1e6, 3), "cached_render_us": round(cached * 1e6, 3)}
+
+
+def _benchmark_info_command(hex_info, node, telegram_server, users, requests_per_user, ttl):
+	Bot.SNAPSHOTS = SnapshotCache(hex_info.refresh_data, ttl, Bot._SNAPSHOT_MAX_STALENESS_SECONDS)
+	telegram_bot = telegram.Bot(token=FakeTelegramServer.TOKEN, base_url=f"{telegram_server.url}/bot")
+	update_data = {"update_id": 1, "message": {"message_id": 1, "date": int(time.time()), "text": "/info",
+											   "chat": {"id": 1, "type": "private", "username": "bench"}}}
+
+	def run_user(_):
+		durations = []
+		for _ in range(requests_per_user):
+			started_at = time.perf_counter()
+			Bot._command_info(telegram_bot, telegram.Update.de_json(update_data, telegram_bot))
+			durations.append(time.perf_counter() - started_at)
+		return durations
+
+	node.reset_counters()
+	telegram_server.reset_counters()
+	started_at = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=users) as executor:
+		durations = [duration for user_durations in executor.map(run_user, range(users)) for duration in user_durations]
+	elapsed = time.perf_counter() - started_at
+	return {
+		"users": users,
+		"requests": len(durations),
+		"throughput_per_second": round(len(durations) / elapsed, 3),
+		"latency_ms": _get_percentiles(durations),
+		"rpc_calls": dict(node.calls),
+		"telegram_calls": dict(telegram_server.calls),
+	}
+
+
+def run_benchmarks(args):
+	recorded_responses = {}
+	if args.responses:
+		with open(args.responses) as responses_file:
+			recorded_responses = json.load(responses_file)
+	# synthetic histories can be longer than the real adoption amplifier
+	HexInfo.CLAIM_PHASE_END_DAY = max(HexInfo.CLAIM_PHASE_END_DAY, args.history_days)
+	# the fake node is in the middle of its last day
+	HexInfo.LAUNCH_TIME = int(time.time()) - args.history_days * HexInfo.SECONDS_PER_DAY - HexInfo.SECONDS_PER_DAY // 2
+	Bot._USER_WHITELIST = []
+	node = FakeEthereumNode(args.rpc_latency / 1000, args.history_days, recorded_responses, args.block_time).start()
+	telegram_server = FakeTelegramServer(args.telegram_latency / 1000).start()
+	results = {"history_days": args.history_days, "rpc_latency_ms": args.rpc_latency,
+			   "telegram_latency_ms": args.telegram_latency}
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			hex_info = HexInfo(os.path.join(directory, "lobby_history.bin"), load_snapshot=False, provider_uri=node.url)
+			results["refresh"] = _benchmark_refresh(hex_info, node, args.refreshes)
+			results["rendering"] = _benchmark_rendering(hex_info.snapshot, args.renders)
+			results["info_command"] = _benchmark_info_command(hex_info, node, telegram_server, args.users,
+															  args.requests_per_user, args.snapshot_ttl)
+		# peak resident memory of the whole process (fake servers included), in kilobytes on linux
+		results["peak_memory_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 3)
+	finally:
+		node.stop()
+		telegram_server.stop()
+	return results
+
+
+def _get_arguments():
+	parser = argparse.ArgumentParser(description="Benchmark Hex info refreshes and the /info command offline.")
+	parser.add_argument("--history-days", type=int, default=350, help="number of synthetic lobby days")
+	parser.add_argument("--rpc-latency", type=float, default=50, help="fake node latency in ms")
+	parser.add_argument("--telegram-latency", type=float, default=50, help="fake telegram latency in ms")
+	parser.add_argument("--block-time", type=float, default=12, help="seconds between fake blocks")
+	parser.add_argument("--responses", help="json file of recorded responses by \"<method> <json params>\"")
+	parser.add_argument("--refreshes", type=int, default=50)
+	parser.add_argument("--renders", type=int, default=1000)
+	parser.add_argument("--users", type=int, default=50, help="concurrent /info users")
+	parser.add_argument("--requests-per-user", type=int, default=10)
+	parser.add_argument("--snapshot-ttl", type=float, default=Bot._SNAPSHOT_TTL_SECONDS)
+	parser.add_argument("--json", action="store_true", help="print results as json")
+	return parser.parse_args()
+
+
+if __name__ == "__main__":
+	arguments = _get_arguments()
+	benchmark_results = run_benchmarks(arguments)
+	if arguments.json:
+		print(json.dumps(benchmark_results, indent=2))
+	else:
+		for section, values in benchmark_results.items():
+			print(f"{section}: {values}")
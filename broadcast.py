@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import asyncio
+from threading import Lock
+
+from metrics import METRICS
+
+
+class SubscriberRegistry:
+	def __init__(self, path, default_chat_ids=()):
+		self.path = path
+		self._lock = Lock()
+		if os.path.isfile(path):
+			with open(path) as subscribers_file:
+				self._chat_ids = json.load(subscribers_file)
+		else:
+			self._chat_ids = [str(chat_id) for chat_id in default_chat_ids]
+
+	def __contains__(self, chat_id):
+		with self._lock:
+			return str(chat_id) in self._chat_ids
+
+	def __len__(self):
+		with self._lock:
+			return len(self._chat_ids)
+
+	def get_chat_ids(self):
+		with self._lock:
+			return list(self._chat_ids)
+
+	def add(self, chat_id):
+		# chat ids are stored as strings: configured ids are strings and telegram accepts both
+		chat_id = str(chat_id)
+		with self._lock:
+			if chat_id in self._chat_ids:
+				return False
+			self._chat_ids.append(chat_id)
+			self._save()
+			return True
+
+	def remove(self, chat_id):
+		chat_id = str(chat_id)
+		with self._lock:
+			if chat_id not in self._chat_ids:
+				return False
+			self._chat_ids.remove(chat_id)
+			self._save()
+			return True
+
+	def _save(self):
+		# write then rename to never leave a truncated subscribers file
+		temp_path = f"{self.path}.tmp"
+		with open(temp_path, "w") as subscribers_file:
+			json.dump(self._chat_ids, subscribers_file)
+		os.replace(temp_path, self.path)
+
+
+def is_blocked_chat_error(description):
+	# forbidden errors of a single chat, unlike an invalid or revoked bot token
+	description = str(description).lower()
+	return any(reason in description for reason in ("blocked", "deactivated", "kicked", "not a member"))
+
+
+def is_chat_not_found_error(description):
+	# other bad requests (unparsable markdown, message too long) come from the message, not from the chat
+	return "chat not found" in str(description).lower()
+
+
+class RetryAfterError(Exception):
+	def __init__(self, retry_after):
+		super().__init__(f"flood control exceeded, retry in {retry_after} seconds")
+		self.retry_after = retry_after
+
+
+class TransientSendError(Exception):
+	pass
+
+
+class PermanentSendError(Exception):
+	pass
+
+
+class RateLimiter:
+	# spaces calls by at least interval seconds, slots are reserved synchronously so no lock is required
+	def __init__(self, interval):
+		self.interval = interval
+		self._next_slot = 0
+		self._paused_until = 0
+
+	async def wait(self):
+		while True:
+			now = time.monotonic()
+			slot = max(now, self._next_slot)
+			self._next_slot = slot + self.interval
+			await asyncio.sleep(slot - now)
+			# a pause started while sleeping: the reserved slot is inside it, reserve a new one after it
+			if self._paused_until <= time.monotonic():
+				return
+
+	def pause(self, seconds):
+		self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+		self._next_slot = max(self._next_slot, self._paused_until)
+
+
+class BroadcastStats:
+	__slots__ = ("recipients", "sent", "failed", "retries", "unsubscribed", "elapsed")
+
+	def __init__(self, recipients):
+		self.recipients = recipients
+		self.sent = 0
+		self.failed = 0
+		self.retries = 0
+		self.unsubscribed = 0
+		self.elapsed = 0
+
+	def __str__(self):
+		return f"{self.sent}/{self.recipients} sent, {self.failed} failed, {self.retries} retries, " \
+			f"{self.unsubscribed} unsubscribed in {round(self.elapsed, 3)}s"
+
+
+class Broadcaster:
+	# telegram allows about 30 messages per second overall and 1 message per second in a chat
+	GLOBAL_SEND_INTERVAL = 1 / 25
+	CHAT_SEND_INTERVAL = 1
+	MAX_CONCURRENT_SENDS = 20
+	MAX_ATTEMPTS = 4
+	BASE_RETRY_DELAY = 1
+
+	def __init__(self, registry, send):
+		# send is a coroutine function(chat_id, content) raising the errors defined above
+		self.registry = registry
+		self.send = send
+		self.global_limiter = RateLimiter(Broadcaster.GLOBAL_SEND_INTERVAL)
+		self._chat_limiters = {}
+
+	async def broadcast(self, content):
+		chat_ids = self.registry.get_chat_ids()
+		stats = BroadcastStats(len(chat_ids))
+		started_at = time.monotonic()
+		semaphore = asyncio.Semaphore(Broadcaster.MAX_CONCURRENT_SENDS)
+		await asyncio.gather(*(self._deliver(chat_id, content, stats, semaphore) for chat_id in chat_ids))
+		stats.elapsed = time.monotonic() - started_at
+		METRICS.observe("hex_broadcast_seconds", stats.elapsed)
+		return stats
+
+	async def _deliver(self, chat_id, content, stats, semaphore):
+		async with semaphore:
+			for attempt in range(Broadcaster.MAX_ATTEMPTS):
+				await self._get_chat_limiter(chat_id).wait()
+				await self.global_limiter.wait()
+				try:
+					with METRICS.time("hex_telegram_send_seconds"):
+						await self.send(chat_id, content)
+					stats.sent += 1
+					METRICS.increment("hex_telegram_messages_total", {"result": "sent"})
+					return
+				except RetryAfterError as e:
+					# flood control applies to the whole bot: hold every send
+					self.global_limiter.pause(e.retry_after)
+					delay = e.retry_after
+					reason = "retry_after"
+				except TransientSendError:
+					delay = Broadcaster.BASE_RETRY_DELAY * 2 ** attempt
+					reason = "transient"
+				except PermanentSendError as e:
+					print(f"Error: failed to send message to {chat_id} ({e}): unsubscribing this chat.")
+					if self.registry.remove(chat_id):
+						stats.unsubscribed += 1
+					break
+				except Exception as e:
+					print(f"Error: failed to send message to {chat_id}: {e}")
+					break
+				if attempt + 1 < Broadcaster.MAX_ATTEMPTS:
+					stats.retries += 1
+					METRICS.increment("hex_telegram_retries_total", {"reason": reason})
+					await asyncio.sleep(delay)
+			stats.failed += 1
+			METRICS.increment("hex_telegram_messages_total", {"result": "failed"})
+
+	def _get_chat_limiter(self, chat_id):
+		if chat_id not in self._chat_limiters:
+			self._chat_limiters[chat_id] = RateLimiter(Broadcaster.CHAT_SEND_INTERVAL)
+		return self._chat_limiters[chat_id]
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+
+from metrics import METRICS, SIZE_BUCKETS
+
+
+class ContractReadBatch:
+	# Multicall3 aggregates several eth_call into a single one executed at a single block
+	MULTICALL_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+	MULTICALL_ABI = [{"constant":False,"inputs":[{"components":[{"name":"target","type":"address"},{"name":"callData","type":"bytes"}],"name":"calls","type":"tuple[]"}],"name":"aggregate","outputs":[{"name":"blockNumber","type":"uint256"},{"name":"returnData","type":"bytes[]"}],"payable":False,"stateMutability":"nonpayable","type":"function"}]
+	MULTICALL_OUTPUT_TYPES = ["uint256", "bytes[]"]
+
+	def __init__(self, w3, contract, multicall=None):
+		# multicall can be shared between batches, see create_multicall_contract
+		self.w3 = w3
+		self.contract = contract
+		self.multicall = multicall if multicall is not None else ContractReadBatch.create_multicall_contract(w3)
+		self.calls = []
+
+	@staticmethod
+	def create_multicall_contract(w3):
+		return w3.eth.contract(address=ContractReadBatch.MULTICALL_ADDRESS, abi=ContractReadBatch.MULTICALL_ABI)
+
+	def __len__(self):
+		return len(self.calls)
+
+	def add(self, function_name, *args):
+		self.calls.append((function_name, args))
+		return self
+
+	def execute(self, block_identifier="latest"):
+		# returns the block number the calls have been executed at and the result of each call in adding order
+		with self._measure_call():
+			raw_result = self.w3.eth.call(self.build_transaction(), block_identifier)
+		return self.decode(raw_result)
+
+	async def execute_async(self, async_w3, block_identifier="latest"):
+		with self._measure_call():
+			raw_result = await async_w3.eth.call(self.build_transaction(), block_identifier)
+		return self.decode(raw_result)
+
+	def build_transaction(self):
+		calls = [
+			(self.contract.address, self.contract.encodeABI(fn_name=function_name, args=list(args)))
+			for function_name, args in self.calls
+		]
+		return {"to": ContractReadBatch.MULTICALL_ADDRESS, "data": self.multicall.encodeABI(fn_name="aggregate", args=[calls])}
+
+	def decode(self, raw_result):
+		METRICS.observe("hex_rpc_response_bytes", len(raw_result), self._get_metric_labels(), SIZE_BUCKETS)
+		block_number, return_data = self.w3.codec.decode_abi(ContractReadBatch.MULTICALL_OUTPUT_TYPES, bytes(raw_result))
+		return block_number, [
+			self._decode_call_result(function_name, data)
+			for (function_name, _), data in zip(self.calls, return_data)
+		]
+
+	@contextmanager
+	def _measure_call(self):
+		labels = self._get_metric_labels()
+		for function_name, _ in self.calls:
+			METRICS.increment("hex_contract_calls_total", {"function": function_name})
+		try:
+			with METRICS.time("hex_rpc_seconds", labels):
+				yield
+		except Exception:
+			METRICS.increment("hex_rpc_errors_total", labels)
+			raise
+
+	def _get_metric_labels(self):
+		return {"method": "eth_call", "functions": "+".join(sorted({function_name for function_name, _ in self.calls}))}
+
+	def _decode_call_result(self, function_name, data):
+		function_abi = next(item for item in self.contract.abi if item.get("type") == "function" and item["name"] == function_name)
+		output_types = [output["type"] for output in function_abi["outputs"]]
+		values = self.w3.codec.decode_abi(output_types, data)
+		return values[0] if len(values) == 1 else values
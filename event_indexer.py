@@ -0,0 +1,289 @@
+import time
+import sqlite3
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from hex_info import HexInfo
+from metrics import METRICS
+
+
+UINT16_MASK = (1 << 16) - 1
+UINT40_MASK = (1 << 40) - 1
+UINT72_MASK = (1 << 72) - 1
+UINT96_MASK = (1 << 96) - 1
+
+
+def _get_day(timestamp):
+	return (timestamp - HexInfo.LAUNCH_TIME) // HexInfo.SECONDS_PER_DAY
+
+
+# packed event fields, as emitted by the Hex contract
+def _decode_xf_lobby_enter(args):
+	return {
+		"timestamp": args["data0"] & UINT40_MASK,
+		"day": args["entryId"] >> 40,
+		"entry_index": args["entryId"] & UINT40_MASK,
+		"address": args["memberAddr"].lower(),
+		"referrer_address": args["referrerAddr"].lower(),
+		"raw_amount": str((args["data0"] >> 40) & UINT96_MASK),
+	}
+
+
+def _decode_xf_lobby_exit(args):
+	return {
+		"timestamp": args["data0"] & UINT40_MASK,
+		"day": args["entryId"] >> 40,
+		"entry_index": args["entryId"] & UINT40_MASK,
+		"address": args["memberAddr"].lower(),
+		"referrer_address": args["referrerAddr"].lower(),
+		"xf_amount": str((args["data0"] >> 40) & UINT72_MASK),
+	}
+
+
+def _decode_stake_start(args):
+	timestamp = args["data0"] & UINT40_MASK
+	return {
+		"timestamp": timestamp,
+		"day": _get_day(timestamp),
+		"address": args["stakerAddr"].lower(),
+		"stake_id": args["stakeId"],
+		"staked_hearts": str((args["data0"] >> 40) & UINT72_MASK),
+		"stake_shares": str((args["data0"] >> 112) & UINT72_MASK),
+		"staked_days": (args["data0"] >> 184) & UINT16_MASK,
+		"is_auto_stake": (args["data0"] >> 200) & 1,
+	}
+
+
+def _decode_stake_end(args):
+	timestamp = args["data0"] & UINT40_MASK
+	return {
+		"timestamp": timestamp,
+		"day": _get_day(timestamp),
+		"address": args["stakerAddr"].lower(),
+		"stake_id": args["stakeId"],
+		"staked_hearts": str((args["data0"] >> 40) & UINT72_MASK),
+		"stake_shares": str((args["data0"] >> 112) & UINT72_MASK),
+		"payout": str((args["data0"] >> 184) & UINT72_MASK),
+		"penalty": str(args["data1"] & UINT72_MASK),
+		"served_days": (args["data1"] >> 72) & UINT16_MASK,
+		"prev_unlocked": (args["data1"] >> 88) & 1,
+	}
+
+
+def _decode_daily_data_update(args):
+	timestamp = args["data0"] & UINT40_MASK
+	return {
+		"timestamp": timestamp,
+		"day": _get_day(timestamp),
+		"address": args["updaterAddr"].lower(),
+		"begin_day": (args["data0"] >> 40) & UINT16_MASK,
+		"end_day": (args["data0"] >> 56) & UINT16_MASK,
+		"is_auto_update": (args["data0"] >> 72) & 1,
+	}
+
+
+class HexEventIndexer:
+	DATABASE_FILE = "hex_events.sqlite"
+	DEPLOYMENT_BLOCK = 9041184
+	# blocks that could still be reorganized are not indexed
+	CONFIRMATIONS = 12
+	WORKERS = 4
+	INITIAL_CHUNK_SIZE = 2000
+	MIN_CHUNK_SIZE = 1
+	MAX_CHUNK_SIZE = 200000
+	# nodes refuse queries returning too many logs (10000 on Infura): aim well below
+	TARGET_LOGS_PER_CHUNK = 4000
+	MAX_ATTEMPTS = 5
+	# getLogs error messages meaning the range holds too many logs and has to be split (infura, alchemy)
+	TOO_MANY_LOGS_ERROR_MESSAGES = ("query returned more than", "log response size exceeded")
+	# event name: (table, decoder, columns), amounts can exceed sqlite integers and are stored as text
+	EVENTS = {
+		"XfLobbyEnter": ("xf_lobby_enters", _decode_xf_lobby_enter,
+						 ["timestamp", "day", "entry_index", "address", "referrer_address", "raw_amount"]),
+		"XfLobbyExit": ("xf_lobby_exits", _decode_xf_lobby_exit,
+						["timestamp", "day", "entry_index", "address", "referrer_address", "xf_amount"]),
+		"StakeStart": ("stake_starts", _decode_stake_start,
+					   ["timestamp", "day", "address", "stake_id", "staked_hearts", "stake_shares", "staked_days",
+						"is_auto_stake"]),
+		"StakeEnd": ("stake_ends", _decode_stake_end,
+					 ["timestamp", "day", "address", "stake_id", "staked_hearts", "stake_shares", "payout", "penalty",
+					  "served_days", "prev_unlocked"]),
+		"DailyDataUpdate": ("daily_data_updates", _decode_daily_data_update,
+							["timestamp", "day", "address", "begin_day", "end_day", "is_auto_update"]),
+	}
+
+	def __init__(self, hex_info, database_path=DATABASE_FILE, workers=WORKERS):
+		self.w3 = hex_info.w3
+		self.contract = hex_info.contract
+		self.workers = workers
+		self.database = sqlite3.connect(database_path, check_same_thread=False)
+		self._database_lock = Lock()
+		self._range_lock = Lock()
+		self._create_tables()
+		self._events_by_topic = {
+			self.w3.keccak(text=HexEventIndexer._get_event_signature(self._get_event_abi(event_name))).hex(): event_name
+			for event_name in HexEventIndexer.EVENTS
+		}
+
+	def get_checkpoint(self):
+		with self._database_lock:
+			row = self.database.execute("SELECT block_number FROM checkpoint WHERE id = 0").fetchone()
+		return row[0] if row else HexEventIndexer.DEPLOYMENT_BLOCK - 1
+
+	def index(self, to_block=None):
+		# resumes from the last block whose logs and all the previous ones are stored
+		if to_block is None:
+			to_block = self.w3.eth.blockNumber - HexEventIndexer.CONFIRMATIONS
+		self._checkpoint = self.get_checkpoint()
+		self._next_block = self._checkpoint + 1
+		self._to_block = to_block
+		self._chunk_size = HexEventIndexer.INITIAL_CHUNK_SIZE
+		self._pending_ranges = []
+		self._completed_ranges = {}
+		self._failed = False
+		started_at = time.time()
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			for worker in [executor.submit(self._run_worker) for _ in range(self.workers)]:
+				worker.result()
+		print(f"Indexed Hex events up to block {self._checkpoint} in {round(time.time() - started_at, 3)}s")
+		return self._checkpoint
+
+	def get_address_events(self, event_name, address):
+		return self._select(event_name, "address = ?", address.lower())
+
+	def get_day_events(self, event_name, day):
+		return self._select(event_name, "day = ?", day)
+
+	def _run_worker(self):
+		try:
+			block_range = self._claim_range()
+			while block_range is not None:
+				self._index_range(*block_range)
+				block_range = self._claim_range()
+		except Exception:
+			self._failed = True
+			raise
+
+	def _claim_range(self):
+		with self._range_lock:
+			if self._failed:
+				return None
+			if self._pending_ranges:
+				return self._pending_ranges.pop()
+			if self._next_block > self._to_block:
+				return None
+			from_block = self._next_block
+			to_block = min(from_block + self._chunk_size - 1, self._to_block)
+			self._next_block = to_block + 1
+			return from_block, to_block, 1
+
+	def _index_range(self, from_block, to_block, attempt):
+		try:
+			with METRICS.time("hex_rpc_seconds", {"method": "eth_getLogs"}):
+				logs = self.w3.eth.getLogs({
+					"address": self.contract.address,
+					"fromBlock": from_block,
+					"toBlock": to_block,
+					"topics": [list(self._events_by_topic)],
+				})
+		except Exception as e:
+			METRICS.increment("hex_rpc_errors_total", {"method": "eth_getLogs"})
+			self._retry_range(from_block, to_block, attempt, e)
+			return
+		self._store_logs(logs, to_block)
+		self._complete_range(from_block, to_block, len(logs))
+
+	def _retry_range(self, from_block, to_block, attempt, error):
+		if HexEventIndexer._is_too_many_logs_error(error) and to_block > from_block:
+			# the range holds more logs than the node returns at once: split it
+			with self._range_lock:
+				self._chunk_size = max(HexEventIndexer.MIN_CHUNK_SIZE, self._chunk_size // 2)
+				middle = (from_block + to_block) // 2
+				self._pending_ranges.append((middle + 1, to_block, attempt))
+				self._pending_ranges.append((from_block, middle, attempt))
+			return
+		if attempt >= HexEventIndexer.MAX_ATTEMPTS:
+			raise error
+		print(f"Error: failed to fetch Hex events of blocks {from_block} to {to_block} ({error}), retrying.")
+		METRICS.increment("hex_rpc_retries_total", {"method": "eth_getLogs"})
+		time.sleep(2 ** attempt)
+		with self._range_lock:
+			self._pending_ranges.append((from_block, to_block, attempt + 1))
+
+	@staticmethod
+	def _is_too_many_logs_error(error):
+		# web3 raises the JSON-RPC error as ValueError({"code": ..., "message": ...}), infura uses code -32005
+		# for both too many logs and rate limits: only the message tells them apart
+		details = error.args[0] if isinstance(error, ValueError) and error.args else None
+		message = details.get("message", "") if isinstance(details, dict) else str(error)
+		return any(pattern in message.lower() for pattern in HexEventIndexer.TOO_MANY_LOGS_ERROR_MESSAGES)
+
+	def _complete_range(self, from_block, to_block, logs_count):
+		with self._range_lock:
+			if logs_count < HexEventIndexer.TARGET_LOGS_PER_CHUNK // 2:
+				self._chunk_size = min(HexEventIndexer.MAX_CHUNK_SIZE, self._chunk_size * 2)
+			elif logs_count > HexEventIndexer.TARGET_LOGS_PER_CHUNK:
+				self._chunk_size = max(HexEventIndexer.MIN_CHUNK_SIZE, self._chunk_size // 2)
+			# ranges complete out of order: only checkpoint contiguous ones
+			self._completed_ranges[from_block] = to_block
+			checkpoint = self._checkpoint
+			while checkpoint + 1 in self._completed_ranges:
+				checkpoint = self._completed_ranges.pop(checkpoint + 1)
+			if checkpoint != self._checkpoint:
+				self._checkpoint = checkpoint
+				self._save_checkpoint(checkpoint)
+
+	def _store_logs(self, logs, to_block):
+		rows_by_event = {}
+		for log in logs:
+			event_name = self._events_by_topic[log["topics"][0].hex()]
+			args = self.contract.events[event_name]().processLog(log)["args"]
+			rows_by_event.setdefault(event_name, []).append(
+				(log["blockNumber"], log["transactionHash"].hex(), log["logIndex"], HexEventIndexer.EVENTS[event_name][1](args))
+			)
+		with self._database_lock, self.database:
+			for event_name, rows in rows_by_event.items():
+				table, _, columns = HexEventIndexer.EVENTS[event_name]
+				# logs of ranges fetched again after a crash are ignored
+				self.database.executemany(
+					f"INSERT OR IGNORE INTO {table} (block_number, transaction_hash, log_index, {', '.join(columns)}) "
+					f"VALUES (?, ?, ?, {', '.join('?' for _ in columns)})",
+					[(block_number, transaction_hash, log_index, *(values[column] for column in columns))
+					 for block_number, transaction_hash, log_index, values in rows]
+				)
+
+	def _save_checkpoint(self, block_number):
+		with self._database_lock, self.database:
+			self.database.execute("INSERT OR REPLACE INTO checkpoint (id, block_number) VALUES (0, ?)", (block_number,))
+
+	def _select(self, event_name, condition, *params):
+		table, _, columns = HexEventIndexer.EVENTS[event_name]
+		with self._database_lock:
+			cursor = self.database.execute(
+				f"SELECT block_number, transaction_hash, log_index, {', '.join(columns)} FROM {table} "
+				f"WHERE {condition} ORDER BY block_number, log_index", params
+			)
+			names = [description[0] for description in cursor.description]
+			return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+	def _create_tables(self):
+		with self._database_lock, self.database:
+			self.database.execute("CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY, block_number INTEGER)")
+			for table, _, columns in HexEventIndexer.EVENTS.values():
+				self.database.execute(
+					f"CREATE TABLE IF NOT EXISTS {table} (block_number INTEGER, transaction_hash TEXT, log_index INTEGER, "
+					f"{', '.join(columns)}, PRIMARY KEY (transaction_hash, log_index))"
+				)
+				self.database.execute(f"CREATE INDEX IF NOT EXISTS {table}_address ON {table} (address)")
+				self.database.execute(f"CREATE INDEX IF NOT EXISTS {table}_day ON {table} (day)")
+
+	def _get_event_abi(self, event_name):
+		return next(item for item in self.contract.abi if item.get("type") == "event" and item["name"] == event_name)
+
+	@staticmethod
+	def _get_event_signature(event_abi):
+		return f"{event_abi['name']}({','.join(event_input['type'] for event_input in event_abi['inputs'])})"
+
+
+if __name__ == "__main__":
+	HexEventIndexer(HexInfo(load_snapshot=False)).index()
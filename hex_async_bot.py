@@ -0,0 +1,243 @@
+import asyncio
+import signal
+from datetime import datetime, timedelta
+import aiohttp
+from web3 import Web3
+from web3.eth import AsyncEth
+from web3.providers.async_rpc import AsyncHTTPProvider
+
+from hex_info import HexInfo
+from hex_snapshot import AsyncSnapshotCache
+from hex_checker_telegram_bot import Bot
+from stake_portfolio import StakePortfolioFetcher
+from metrics import METRICS
+from broadcast import SubscriberRegistry, Broadcaster, RetryAfterError, TransientSendError, PermanentSendError, \
+	is_chat_not_found_error
+
+
+class AsyncTelegramError(Exception):
+	def __init__(self, description, error_code=None, retry_after=None):
+		super().__init__(description)
+		self.error_code = error_code
+		self.retry_after = retry_after
+
+
+class AsyncTelegramClient:
+	API_URL = "https://api.telegram.org"
+	REQUEST_TIMEOUT = 10
+
+	def __init__(self, session, token, api_url=API_URL):
+		self.session = session
+		self.base_url = f"{api_url}/bot{token}"
+
+	async def request(self, method, request_timeout=REQUEST_TIMEOUT, **params):
+		async with self.session.post(f"{self.base_url}/{method}", json=params,
+									 timeout=aiohttp.ClientTimeout(total=request_timeout)) as response:
+			body = await response.json()
+		if not body.get("ok"):
+			raise AsyncTelegramError(body.get("description"), body.get("error_code"),
+									 body.get("parameters", {}).get("retry_after"))
+		return body["result"]
+
+	async def send_message(self, chat_id, text, markdown=True):
+		params = {"chat_id": chat_id, "text": text}
+		if markdown:
+			params["parse_mode"] = "Markdown"
+		return await self.request("sendMessage", **params)
+
+	async def get_updates(self, offset, timeout):
+		# long polling: the request timeout has to outlast the telegram side timeout
+		return await self.request("getUpdates", request_timeout=timeout + AsyncTelegramClient.REQUEST_TIMEOUT,
+								  offset=offset, timeout=timeout, allowed_updates=["message"])
+
+
+class AsyncBot:
+	# seconds telegram keeps a getUpdates request open when there is no new message
+	_UPDATES_POLLING_TIMEOUT = 30
+	_ADMIN_COMMANDS = {"metrics"}
+
+	def __init__(self, hex_info, async_w3, telegram_client):
+		self.hex_info = hex_info
+		self.async_w3 = async_w3
+		self.telegram = telegram_client
+		self.snapshots = AsyncSnapshotCache(lambda: hex_info.refresh_data_async(async_w3), Bot._SNAPSHOT_TTL_SECONDS,
+											Bot._SNAPSHOT_MAX_STALENESS_SECONDS, snapshot=hex_info.snapshot)
+		Bot.SUBSCRIBERS = SubscriberRegistry(Bot._SUBSCRIBERS_FILE, [Bot._CHAT_ID])
+		Bot.STAKES = StakePortfolioFetcher(hex_info)
+		self.broadcaster = Broadcaster(Bot.SUBSCRIBERS, self._send_to_chat)
+		self.commands = {
+			"start": self._command_start,
+			"ping": self._command_ping,
+			"info": self._command_info,
+			"stakes": self._command_stakes,
+			"subscribe": self._command_subscribe,
+			"unsubscribe": self._command_unsubscribe,
+			"help": self._command_help,
+			"metrics": self._command_metrics,
+		}
+		self._stopped = asyncio.Event()
+		self._handlers = set()
+
+	async def run(self):
+		print("Launching Hex info Telegram bot (asyncio)")
+		loop = asyncio.get_running_loop()
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(sig, self.stop)
+		tasks = [
+			asyncio.create_task(self._poll_updates()),
+			asyncio.create_task(self._send_daily_notifications()),
+			asyncio.create_task(self._send_startup_messages()),
+		]
+		await self._stopped.wait()
+		print("Stopping Telegram bot ...")
+		for task in tasks + list(self._handlers):
+			task.cancel()
+		await asyncio.gather(*tasks, *self._handlers, return_exceptions=True)
+
+	def stop(self):
+		self._stopped.set()
+
+	async def send_message(self, content, chat_id=Bot._CHAT_ID, markdown=True):
+		if not content:
+			return
+		try:
+			try:
+				await self._send_message(chat_id, content, markdown)
+			except asyncio.TimeoutError:
+				# retry on failing
+				METRICS.increment("hex_telegram_retries_total", {"reason": "transient"})
+				await self._send_message(chat_id, content, markdown)
+		except (asyncio.TimeoutError, aiohttp.ClientError, AsyncTelegramError) as e:
+			METRICS.increment("hex_telegram_messages_total", {"result": "failed"})
+			print(f"Error: failed to send message : {e}")
+
+	async def _send_message(self, chat_id, content, markdown):
+		with METRICS.time("hex_telegram_send_seconds"):
+			await self.telegram.send_message(chat_id, content, markdown)
+		METRICS.increment("hex_telegram_messages_total", {"result": "sent"})
+
+	async def send_info(self, snapshot=None):
+		await self.send_message(Bot._get_info_message(snapshot or await self.snapshots.get()))
+
+	async def broadcast_info(self, snapshot=None):
+		stats = await self.broadcaster.broadcast(Bot._get_info_message(snapshot or await self.snapshots.get()))
+		print(f"Info message broadcast: {stats}")
+		return stats
+
+	async def _send_to_chat(self, chat_id, content):
+		try:
+			await self.telegram.send_message(chat_id, content)
+		except AsyncTelegramError as e:
+			if e.retry_after is not None:
+				raise RetryAfterError(e.retry_after)
+			if e.error_code == 403 or (e.error_code == 400 and is_chat_not_found_error(e)):
+				# bot blocked by the user or chat not found
+				raise PermanentSendError(e)
+			if e.error_code == 400:
+				raise
+			raise TransientSendError(e)
+		except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+			raise TransientSendError(e)
+
+	async def _send_startup_messages(self):
+		await self.send_message("*Hex info Telegram Bot online !*")
+		await self.send_info()
+
+	async def _send_daily_notifications(self):
+		while True:
+			await asyncio.sleep(AsyncBot._get_seconds_until_next_notification(datetime.now()))
+			try:
+				print(f"Info message sent at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+				with METRICS.time("hex_daily_notification_seconds"):
+					await self.broadcast_info(await self.snapshots.refresh())
+			except Exception as e:
+				print(f"Error: failed to send daily notification: {e}")
+
+	@staticmethod
+	def _get_seconds_until_next_notification(now):
+		notification_time = datetime.strptime(Bot._NOTIFICATION_LOCAL_24h_TIME, "%H:%M:%S").time()
+		next_notification = datetime.combine(now.date(), notification_time)
+		if next_notification <= now:
+			next_notification += timedelta(days=1)
+		return (next_notification - now).total_seconds()
+
+	async def _poll_updates(self):
+		offset = None
+		while True:
+			try:
+				updates = await self.telegram.get_updates(offset, AsyncBot._UPDATES_POLLING_TIMEOUT)
+			except (asyncio.TimeoutError, aiohttp.ClientError, AsyncTelegramError) as e:
+				print(f"Error: failed to get telegram updates: {e}")
+				await asyncio.sleep(1)
+				continue
+			for update in updates:
+				offset = update["update_id"] + 1
+				if "message" in update:
+					# each message is handled on its own so that a slow command does not delay the others
+					handler = asyncio.create_task(self._handle_message(update["message"]))
+					self._handlers.add(handler)
+					handler.add_done_callback(self._handlers.discard)
+
+	async def _handle_message(self, message):
+		chat = message["chat"]
+		if not Bot._is_valid_chat(chat["type"], chat.get("username")):
+			return
+		text = message.get("text", "")
+		try:
+			if text.startswith("/"):
+				command, *args = text.split()
+				command = command[1:].split("@")[0]
+				if command in AsyncBot._ADMIN_COMMANDS and not Bot._is_admin(chat.get("username")):
+					return
+				if command in self.commands:
+					await self.commands[command](chat["id"], args)
+				else:
+					await self.send_message(f"Unfortunately, I don't know the command: {text}.", chat["id"], False)
+			elif text:
+				await self.send_message(text, chat["id"], False)
+		except Exception as e:
+			await self.send_message(f"Failed to perform this command error: `{e}`", chat["id"])
+
+	async def _command_start(self, chat_id, _):
+		await self.send_message(Bot._get_start_message(), chat_id)
+
+	async def _command_stakes(self, chat_id, args):
+		address = Bot._get_stakes_address(args)
+		if address is None:
+			await self.send_message(Bot._get_stakes_usage_message(), chat_id)
+		else:
+			stakes = await Bot.STAKES.get_stakes_async(address, self.async_w3)
+			await self.send_message(Bot._get_stakes_message(address, stakes), chat_id)
+
+	async def _command_subscribe(self, chat_id, _):
+		await self.send_message(Bot._get_subscribe_message(chat_id), chat_id)
+
+	async def _command_unsubscribe(self, chat_id, _):
+		await self.send_message(Bot._get_unsubscribe_message(chat_id), chat_id)
+
+	async def _command_ping(self, chat_id, _):
+		await self.send_message(Bot._get_ping_message(), chat_id)
+
+	async def _command_info(self, chat_id, _):
+		await self.send_message(Bot._get_info_message(await self.snapshots.get()), chat_id)
+
+	async def _command_metrics(self, chat_id, _):
+		await self.send_message(Bot._get_metrics_message(), chat_id)
+
+	async def _command_help(self, chat_id, _):
+		await self.send_message(Bot._get_help_message(), chat_id)
+
+
+async def _run_bot(hex_info):
+	async with aiohttp.ClientSession() as session:
+		provider = AsyncHTTPProvider(hex_info.w3.provider.endpoint_uri)
+		await provider.cache_async_session(session)
+		async_w3 = Web3(provider, modules={"eth": (AsyncEth,)}, middlewares=[])
+		await AsyncBot(hex_info, async_w3, AsyncTelegramClient(session, Bot._TOKEN)).run()
+
+
+def run():
+	Bot.start_monitoring()
+	hex_info = HexInfo(load_snapshot=False, provider_uri=Bot._RPC_URI,
+					   snapshot_lowest_lobby_sizes=Bot._COMPARED_LOWEST_LOBBY_SIZES + 1)
+	asyncio.run(_run_bot(hex_info))
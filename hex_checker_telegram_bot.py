@@ -1,13 +1,20 @@
 import time
+import asyncio
 import schedule
 import sys
 import signal
 from datetime import datetime
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 import telegram
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 
 from hex_info import HexInfo
+from hex_snapshot import SnapshotCache
+from stake_portfolio import StakePortfolioFetcher
+from metrics import METRICS, SamplingProfiler, start_metrics_server
+from broadcast import SubscriberRegistry, Broadcaster, RetryAfterError, TransientSendError, PermanentSendError, \
+	is_blocked_chat_error, is_chat_not_found_error
 
 class Bot:
 
@@ -25,16 +32,44 @@ class Bot:
 	_COMPARED_LOWEST_LOBBY_SIZES = 3
 	# time of the daily telegram notification (HH:MM:SS in local time)
 	_NOTIFICATION_LOCAL_24h_TIME = "00:00:25"
+	# seconds during which Hex info is reused without any request to the node
+	_SNAPSHOT_TTL_SECONDS = 15
+	# additional seconds during which outdated Hex info is answered while being refreshed
+	_SNAPSHOT_MAX_STALENESS_SECONDS = 120
+	# file storing the chats subscribed to the daily notification (initialized with _CHAT_ID)
+	_SUBSCRIBERS_FILE = "subscribers.json"
+	# maximum number of stakes listed by /stakes
+	_DISPLAYED_STAKES = 20
+	# users allowed to use admin commands (/metrics)
+	_ADMIN_USERS = ["YOUR_TELEGRAM_USERNAME"]
+	# local port of the Prometheus metrics endpoint, for example 9108 (None to disable it)
+	_METRICS_PORT = None
+	# seconds between sampling profiler samples shown in /metrics (None to disable profiling)
+	_PROFILER_SAMPLING_INTERVAL_SECONDS = None
+	# ethereum node HTTP RPC endpoint (None to use the web3 auto infura provider)
+	_RPC_URI = None
+	# answer commands right away and load Hex info in the background on startup
+	_LAZY_STARTUP = True
 	
 	# ------------ ------ ------------ #
 
 	START_TIME = time.time()
 	HEX_INFO = None
+	SNAPSHOTS = None
+	SUBSCRIBERS = None
+	STAKES = None
+	PROFILER = None
 	
 	def __init__(self, hex_info):
 		Bot.HEX_INFO = hex_info
+		Bot.SNAPSHOTS = SnapshotCache(hex_info.refresh_data, Bot._SNAPSHOT_TTL_SECONDS,
+									  Bot._SNAPSHOT_MAX_STALENESS_SECONDS, snapshot=hex_info.snapshot)
 		self.telegram_api = telegram.Bot(token=Bot._TOKEN)
 		self.telegram_updater = Updater(token=Bot._TOKEN)
+		Bot.SUBSCRIBERS = SubscriberRegistry(Bot._SUBSCRIBERS_FILE, [Bot._CHAT_ID])
+		Bot.STAKES = StakePortfolioFetcher(hex_info)
+		self.broadcaster = Broadcaster(Bot.SUBSCRIBERS, self._send_to_chat_async)
+		self._send_executor = ThreadPoolExecutor(max_workers=Broadcaster.MAX_CONCURRENT_SENDS)
 		self._register_handlers()
 
 		
@@ -44,18 +79,55 @@ class Bot:
 			kwargs["parse_mode"] = telegram.parsemode.ParseMode.MARKDOWN
 		try:
 			if content:
-				self.telegram_api.send_message(chat_id=Bot._CHAT_ID, text=content, **kwargs)
+				self._send_to_admin_chat(content, **kwargs)
 		except telegram.error.TimedOut:
 			# retry on failing
+			METRICS.increment("hex_telegram_retries_total", {"reason": "transient"})
 			try:
-				self.telegram_api.send_message(chat_id=Bot._CHAT_ID, text=content, **kwargs)
+				self._send_to_admin_chat(content, **kwargs)
 			except telegram.error.TimedOut as e:
+				METRICS.increment("hex_telegram_messages_total", {"result": "failed"})
 				print(f"Error: failed to send message : {e}")
 		except telegram.error.Unauthorized as e:
+			METRICS.increment("hex_telegram_messages_total", {"result": "failed"})
 			print(f"Error: failed to send message ({e}): invalid telegram configuration.")
+
+	def _send_to_admin_chat(self, content, **kwargs):
+		with METRICS.time("hex_telegram_send_seconds"):
+			self.telegram_api.send_message(chat_id=Bot._CHAT_ID, text=content, **kwargs)
+		METRICS.increment("hex_telegram_messages_total", {"result": "sent"})
 			
-	def send_info(self):
-		self.send_message(self._get_info_message())
+	def send_info(self, snapshot=None):
+		self.send_message(self._get_info_message(snapshot or Bot.SNAPSHOTS.get()))
+
+	def broadcast_info(self, snapshot=None):
+		stats = asyncio.run(self.broadcaster.broadcast(self._get_info_message(snapshot or Bot.SNAPSHOTS.get())))
+		print(f"Info message broadcast: {stats}")
+		return stats
+
+	async def _send_to_chat_async(self, chat_id, content):
+		# python-telegram-bot is synchronous: concurrent sends run in a thread pool
+		await asyncio.get_running_loop().run_in_executor(self._send_executor, self._send_to_chat, chat_id, content)
+
+	def _send_to_chat(self, chat_id, content):
+		try:
+			# sends are timed by the broadcaster on the event loop thread while this runs in the pool
+			with METRICS.section("hex_telegram_send_seconds"):
+				self.telegram_api.send_message(chat_id=chat_id, text=content,
+											   parse_mode=telegram.parsemode.ParseMode.MARKDOWN)
+		except telegram.error.RetryAfter as e:
+			raise RetryAfterError(e.retry_after)
+		except telegram.error.Unauthorized as e:
+			# also raised on an invalid telegram token: only unsubscribe chats that blocked the bot
+			if is_blocked_chat_error(e.message):
+				raise PermanentSendError(e)
+			raise
+		except telegram.error.BadRequest as e:
+			if is_chat_not_found_error(e.message):
+				raise PermanentSendError(e)
+			raise
+		except (telegram.error.TimedOut, telegram.error.NetworkError) as e:
+			raise TransientSendError(e)
 			
 	def start(self):
 		print("Launching Hex info Telegram bot")
@@ -77,41 +149,60 @@ class Bot:
 			CommandHandler("start", self._command_start),
 			CommandHandler("ping", self._command_ping),
 			CommandHandler("info", self._command_info),
+			CommandHandler("stakes", self._command_stakes),
+			CommandHandler("subscribe", self._command_subscribe),
+			CommandHandler("unsubscribe", self._command_unsubscribe),
 			CommandHandler("help", self._command_help),
+			CommandHandler("metrics", self._command_metrics),
 			MessageHandler(Filters.command, self._command_unknown)
 		]
 	
 	@staticmethod
 	def _command_start(_, update):
 		if Bot._is_valid_request(update):
-			update.message.reply_markdown("Hello, I'm the Hex info Bot. I will update you before the "
-			"end of each adoption amplifier lobby.\nType /info to get the current lobby info.\nType "
-			"/help to get help about my skills.")
+			update.message.reply_markdown(Bot._get_start_message())
 		else:
 			update.message.reply_markdown(update, "Nope")
 	
 	@staticmethod
 	def _command_info(_, update):
 		if Bot._is_valid_request(update):
-			Bot.HEX_INFO.refresh_data()
-			update.message.reply_markdown(Bot._get_info_message())
+			update.message.reply_markdown(Bot._get_info_message(Bot.SNAPSHOTS.get()))
+	
+	@staticmethod
+	def _command_stakes(_, update):
+		if Bot._is_valid_request(update):
+			address = Bot._get_stakes_address(update.effective_message.text.split()[1:])
+			if address is None:
+				update.message.reply_markdown(Bot._get_stakes_usage_message())
+			else:
+				update.message.reply_markdown(Bot._get_stakes_message(address, Bot.STAKES.get_stakes(address)))
+
+	@staticmethod
+	def _command_subscribe(_, update):
+		if Bot._is_valid_request(update):
+			update.message.reply_markdown(Bot._get_subscribe_message(update.effective_chat["id"]))
+
+	@staticmethod
+	def _command_unsubscribe(_, update):
+		if Bot._is_valid_request(update):
+			update.message.reply_markdown(Bot._get_unsubscribe_message(update.effective_chat["id"]))
 	
 	@staticmethod
 	def _command_ping(_, update):
 		if Bot._is_valid_request(update):
-			update.message.reply_markdown(
-				f"I'm alive since {datetime.fromtimestamp(Bot.START_TIME).strftime('%Y-%m-%d %H:%M:%S')}.")
+			update.message.reply_markdown(Bot._get_ping_message())
 	
 	@staticmethod
 	def _command_help(_, update):
 		if Bot._is_valid_request(update):
-			message = "* - My Hex info Bot skills - *\n\n"
-			message += "/start: `Displays my startup message.`\n"
-			message += "/ping: `Shows for how long I'm working.`\n"
-			message += "/info: `Shows Hex useful info.`\n"
-			message += "/help: `Shows this help.`"
-			update.message.reply_markdown(message)
+			update.message.reply_markdown(Bot._get_help_message())
+
 
+	@staticmethod
+	def _command_metrics(_, update):
+		if Bot._is_admin_request(update):
+			update.message.reply_markdown(Bot._get_metrics_message())
 
 	@staticmethod
 	def _command_unknown(_, update):
@@ -129,49 +220,160 @@ class Bot:
 	
 	@staticmethod
 	def _is_valid_request(update):
-		user_name =update.effective_chat["username"]
-		return update.effective_chat["type"] in Bot._HANDLED_CHATS and \
+		return Bot._is_valid_chat(update.effective_chat["type"], update.effective_chat["username"])
+
+	@staticmethod
+	def _is_admin_request(update):
+		return Bot._is_valid_request(update) and Bot._is_admin(update.effective_chat["username"])
+
+	@staticmethod
+	def _is_admin(user_name):
+		return user_name in Bot._ADMIN_USERS or f"@{user_name}" in Bot._ADMIN_USERS
+
+	@staticmethod
+	def _is_valid_chat(chat_type, user_name):
+		return chat_type in Bot._HANDLED_CHATS and \
 			(not Bot._USER_WHITELIST or user_name in Bot._USER_WHITELIST or f"@{user_name}" in Bot._USER_WHITELIST)
+
+	@staticmethod
+	def _get_start_message():
+		return "Hello, I'm the Hex info Bot. I will update you before the " \
+			"end of each adoption amplifier lobby.\nType /info to get the current lobby info.\nType " \
+			"/help to get help about my skills."
+
+	@staticmethod
+	def _get_ping_message():
+		return f"I'm alive since {datetime.fromtimestamp(Bot.START_TIME).strftime('%Y-%m-%d %H:%M:%S')}."
+
+	@staticmethod
+	def _get_subscribe_message(chat_id):
+		if Bot.SUBSCRIBERS.add(chat_id):
+			return "You will now receive the daily lobby info."
+		return "You are already receiving the daily lobby info."
+
+	@staticmethod
+	def _get_unsubscribe_message(chat_id):
+		if Bot.SUBSCRIBERS.remove(chat_id):
+			return "You will no longer receive the daily lobby info."
+		return "You are not receiving the daily lobby info."
+
+	@staticmethod
+	def _get_help_message():
+		message = "* - My Hex info Bot skills - *\n\n"
+		message += "/start: `Displays my startup message.`\n"
+		message += "/ping: `Shows for how long I'm working.`\n"
+		message += "/info: `Shows Hex useful info.`\n"
+		message += "/stakes <address>: `Shows the active stakes of an address.`\n"
+		message += "/subscribe: `Sends you the daily lobby info.`\n"
+		message += "/unsubscribe: `Stops sending you the daily lobby info.`\n"
+		message += "/help: `Shows this help.`"
+		return message
 	
 	@staticmethod
-	def _get_info_message():
+	def _get_metrics_message():
+		# telegram messages are limited to 4096 characters
+		message = "* - Metrics - *\n```\n" + METRICS.render_summary()[:3000] + "\n```"
+		if Bot.PROFILER is not None:
+			message += f"\n*Profiler ({Bot.PROFILER.sample_count} samples)*\n```\n"
+			message += "\n".join(f"{count} {location}" for location, count in Bot.PROFILER.get_top_locations(10))[:800]
+			message += "\n```"
+		return message
+
+	@staticmethod
+	def start_monitoring():
+		if Bot._METRICS_PORT is not None:
+			try:
+				start_metrics_server(Bot._METRICS_PORT)
+			except OSError as e:
+				# metrics are optional: never prevent the bot from starting
+				print(f"Warning: failed to serve metrics on port {Bot._METRICS_PORT} ({e}), metrics are not exposed.")
+		if Bot._PROFILER_SAMPLING_INTERVAL_SECONDS is not None:
+			Bot.PROFILER = SamplingProfiler(Bot._PROFILER_SAMPLING_INTERVAL_SECONDS).start()
+
+	@staticmethod
+	def _get_stakes_address(args):
+		from web3 import Web3
+		if len(args) != 1 or not Web3.isAddress(args[0]):
+			return None
+		return Web3.toChecksumAddress(args[0])
+
+	@staticmethod
+	def _get_stakes_usage_message():
+		return "Usage: `/stakes <ethereum address>`"
+
+	@staticmethod
+	def _get_stakes_message(address, stakes):
+		message = f"* - Stakes of {address} - *\n\n"
+		if not stakes:
+			return message + "No active stake."
+		message += f"Active stakes: *{len(stakes)}*\n"
+		message += f"Staked: `{round(HexInfo.heart_to_hex(sum(s.staked_hearts for s in stakes)), 3)} HEX`\n"
+		message += f"Shares: `{round(sum(s.stake_shares for s in stakes) / 1e12, 6)} T-Shares`\n\n"
+		for stake in stakes[:Bot._DISPLAYED_STAKES]:
+			message += f"`{stake.stake_id}`: {round(HexInfo.heart_to_hex(stake.staked_hearts), 3)} HEX " \
+				f"from day {stake.locked_day} to {stake.get_end_day()}"
+			message += " (unlocked)\n" if stake.unlocked_day else "\n"
+		if len(stakes) > Bot._DISPLAYED_STAKES:
+			message += f"... and {len(stakes) - Bot._DISPLAYED_STAKES} more"
+		return message
+
+	@staticmethod
+	def _get_info_message(snapshot):
+		return snapshot.get_rendered("info", Bot._render_info_message)
+
+	@staticmethod
+	def _render_info_message(snapshot):
 		message = "* - Today's lobby info - *\n\n"
-		message += f"Adoption amplifier day: *{Bot.HEX_INFO.current_day}*\n\n"
-		message += f"Lobby size: `{round(Bot.HEX_INFO.get_current_day_lobby_eth_size(), 3)} ETH`\n"
-		if Bot.HEX_INFO.is_lowest_lobby_size():
+		message += f"Adoption amplifier day: *{snapshot.current_day}*\n\n"
+		message += f"Lobby size: `{round(HexInfo.wei_to_eth(snapshot.current_day_lobby_size), 3)} ETH`\n"
+		if snapshot.is_lowest_lobby_size():
 			message += f"- *Today is the smallest lobby size so far !*\n"
-		elif Bot.HEX_INFO.is_in_lowest_lobby_sizes(Bot._COMPARED_LOWEST_LOBBY_SIZES):
+		elif snapshot.is_in_lowest_lobby_sizes(Bot._COMPARED_LOWEST_LOBBY_SIZES):
 			message += f"*- Today is within the {Bot._COMPARED_LOWEST_LOBBY_SIZES} smallest lobby sizes so far !*\n"
 		else:
 			message += "- Today is not one of the smallest lobby days\n"
-		historical_lobbies = Bot.HEX_INFO.get_lowest_historical_lobbies_sizes(Bot._COMPARED_LOWEST_LOBBY_SIZES)
+		historical_lobbies = snapshot.get_lowest_historical_lobbies_sizes(Bot._COMPARED_LOWEST_LOBBY_SIZES)
 		str_lobbies = [str(round(HexInfo.wei_to_eth(h), 3)) for h in historical_lobbies]
 		message += f"Smallest lobby sizes: *{', '.join(str_lobbies)} ETH*\n\n"
 			
-		message += f"Stacked percent: `{round(Bot.HEX_INFO.get_stacked_ratio() * 100, 3)}%`\n"
-		message += f"Circulating supply: `{round(HexInfo.heart_to_hex(Bot.HEX_INFO.circulating_supply) / 1e6, 6)} million Hex`\n"
-		message += f"Total supply: `{round(HexInfo.heart_to_hex(Bot.HEX_INFO.total_supply) / 1e6, 6)} million HEX`"
+		message += f"Stacked percent: `{round(snapshot.get_stacked_ratio() * 100, 3)}%`\n"
+		message += f"Circulating supply: `{round(HexInfo.heart_to_hex(snapshot.circulating_supply) / 1e6, 6)} million Hex`\n"
+		message += f"Total supply: `{round(HexInfo.heart_to_hex(snapshot.total_supply) / 1e6, 6)} million HEX`"
 		return message
 		
 
-hex = HexInfo()
-bot = Bot(hex)
 keep_running = True
 	
 	
-def refresh_and_send_info():
-	print(f"Info message sent at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-	hex.refresh_data()
-	bot.send_info()
+def refresh_and_send_info(bot):
+	# errors would stop the scheduler loop: the next notifications still have to be sent
+	try:
+		print(f"Info message sent at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+		with METRICS.time("hex_daily_notification_seconds"):
+			bot.broadcast_info(Bot.SNAPSHOTS.refresh())
+	except Exception as e:
+		print(f"Error: failed to send daily notification: {e}")
 	
 	
-def start_scheduler():
-	schedule.every().day.at(Bot._NOTIFICATION_LOCAL_24h_TIME).do(refresh_and_send_info)
+def start_scheduler(bot):
+	schedule.every().day.at(Bot._NOTIFICATION_LOCAL_24h_TIME).do(refresh_and_send_info, bot)
 	while keep_running:
 		schedule.run_pending()
 		time.sleep(5)
-		
-if __name__ == "__main__":
+
+
+def send_startup_messages(bot):
+	bot.send_message("*Hex info Telegram Bot online !*")
+	bot.send_info()
+
+
+def main():
+	Bot.start_monitoring()
+	# is_in_lowest_lobby_sizes(count) compares today with the (count + 1)th smallest lobby
+	hex_info = HexInfo(load_snapshot=not Bot._LAZY_STARTUP, provider_uri=Bot._RPC_URI,
+					   snapshot_lowest_lobby_sizes=Bot._COMPARED_LOWEST_LOBBY_SIZES + 1)
+	bot = Bot(hex_info)
+
 	def signal_handler(sig, frame):
 		global keep_running
 		keep_running = False
@@ -179,8 +381,18 @@ if __name__ == "__main__":
 	signal.signal(signal.SIGINT, signal_handler)
 
 	Thread(bot.start()).start()
-	bot.send_message("*Hex info Telegram Bot online !*")
-	bot.send_info()
+	if Bot._LAZY_STARTUP:
+		# the first snapshot is loaded by this thread, /info requests received meanwhile wait for it
+		Thread(target=send_startup_messages, args=(bot,), daemon=True).start()
+	else:
+		send_startup_messages(bot)
+
+	start_scheduler(bot)
 
-	start_scheduler()
-	
\ No newline at end of file
+		
+if __name__ == "__main__":
+	if "--asyncio" in sys.argv:
+		from hex_async_bot import run
+		run()
+	else:
+		main()
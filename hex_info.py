@@ -1,30 +1,122 @@
+import time
+from threading import Lock
+
+from lobby_history import LobbyHistory
+from hex_snapshot import HexSnapshot
+from contract_batch import ContractReadBatch
+
+
 class HexInfo:
 	ADDRESS = "0x2b591e99afE9f32eAA6214f7B7629768c40Eeb39"
-	ABI = """[{"inputs":[],"payable":false,"stateMutability":"nonpayable","type":"constructor"},{"anonymous":false,"inputs":[{"indexed":true,"internalType":"address","name":"owner","type":"address"},{"indexed":true,"internalType":"address","name":"spender","type":"address"},{"indexed":false,"internalType":"uint256","name":"value","type":"uint256"}],"name":"Approval","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":false,"internalType":"uint256","name":"data1","type":"uint256"},{"indexed":true,"internalType":"bytes20","name":"btcAddr","type":"bytes20"},{"indexed":true,"internalType":"address","name":"claimToAddr","type":"address"},{"indexed":true,"internalType":"address","name":"referrerAddr","type":"address"}],"name":"Claim","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":false,"internalType":"uint256","name":"data1","type":"uint256"},{"indexed":false,"internalType":"uint256","name":"data2","type":"uint256"},{"indexed":true,"internalType":"address","name":"senderAddr","type":"address"}],"name":"ClaimAssist","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":true,"internalType":"address","name":"updaterAddr","type":"address"}],"name":"DailyDataUpdate","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":true,"internalType":"uint40","name":"stakeId","type":"uint40"}],"name":"ShareRateChange","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":false,"internalType":"uint256","name":"data1","type":"uint256"},{"indexed":true,"internalType":"address","name":"stakerAddr","type":"address"},{"indexed":true,"internalType":"uint40","name":"stakeId","type":"uint40"}],"name":"StakeEnd","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":false,"internalType":"uint256","name":"data1","type":"uint256"},{"indexed":true,"internalType":"address","name":"stakerAddr","type":"address"},{"indexed":true,"internalType":"uint40","name":"stakeId","type":"uint40"},{"indexed":true,"internalType":"address","name":"senderAddr","type":"address"}],"name":"StakeGoodAccounting","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":true,"internalType":"address","name":"stakerAddr","type":"address"},{"indexed":true,"internalType":"uint40","name":"stakeId","type":"uint40"}],"name":"StakeStart","type":"event"},{"anonymous":false,"inputs":[{"indexed":true,"internalType":"address","name":"from","type":"address"},{"indexed":true,"internalType":"address","name":"to","type":"address"},{"indexed":false,"internalType":"uint256","name":"value","type":"uint256"}],"name":"Transfer","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":true,"internalType":"address","name":"memberAddr","type":"address"},{"indexed":true,"internalType":"uint256","name":"entryId","type":"uint256"},{"indexed":true,"internalType":"address","name":"referrerAddr","type":"address"}],"name":"XfLobbyEnter","type":"event"},{"anonymous":false,"inputs":[{"indexed":false,"internalType":"uint256","name":"data0","type":"uint256"},{"indexed":true,"internalType":"address","name":"memberAddr","type":"address"},{"indexed":true,"internalType":"uint256","name":"entryId","type":"uint256"},{"indexed":true,"internalType":"address","name":"referrerAddr","type":"address"}],"name":"XfLobbyExit","type":"event"},{"payable":true,"stateMutability":"payable","type":"fallback"},{"constant":true,"inputs":[],"name":"allocatedSupply","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"owner","type":"address"},{"internalType":"address","name":"spender","type":"address"}],"name":"allowance","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"spender","type":"address"},{"internalType":"uint256","name":"amount","type":"uint256"}],"name":"approve","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"account","type":"address"}],"name":"balanceOf","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"uint256","name":"rawSatoshis","type":"uint256"},{"internalType":"bytes32[]","name":"proof","type":"bytes32[]"},{"internalType":"address","name":"claimToAddr","type":"address"},{"internalType":"bytes32","name":"pubKeyX","type":"bytes32"},{"internalType":"bytes32","name":"pubKeyY","type":"bytes32"},{"internalType":"uint8","name":"claimFlags","type":"uint8"},{"internalType":"uint8","name":"v","type":"uint8"},{"internalType":"bytes32","name":"r","type":"bytes32"},{"internalType":"bytes32","name":"s","type":"bytes32"},{"internalType":"uint256","name":"autoStakeDays","type":"uint256"},{"internalType":"address","name":"referrerAddr","type":"address"}],"name":"btcAddressClaim","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"internalType":"bytes20","name":"","type":"bytes20"}],"name":"btcAddressClaims","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"bytes20","name":"btcAddr","type":"bytes20"},{"internalType":"uint256","name":"rawSatoshis","type":"uint256"},{"internalType":"bytes32[]","name":"proof","type":"bytes32[]"}],"name":"btcAddressIsClaimable","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"bytes20","name":"btcAddr","type":"bytes20"},{"internalType":"uint256","name":"rawSatoshis","type":"uint256"},{"internalType":"bytes32[]","name":"proof","type":"bytes32[]"}],"name":"btcAddressIsValid","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"pure","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"claimToAddr","type":"address"},{"internalType":"bytes32","name":"claimParamHash","type":"bytes32"},{"internalType":"bytes32","name":"pubKeyX","type":"bytes32"},{"internalType":"bytes32","name":"pubKeyY","type":"bytes32"},{"internalType":"uint8","name":"claimFlags","type":"uint8"},{"internalType":"uint8","name":"v","type":"uint8"},{"internalType":"bytes32","name":"r","type":"bytes32"},{"internalType":"bytes32","name":"s","type":"bytes32"}],"name":"claimMessageMatchesSignature","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"pure","type":"function"},{"constant":true,"inputs":[],"name":"currentDay","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"uint256","name":"","type":"uint256"}],"name":"dailyData","outputs":[{"internalType":"uint72","name":"dayPayoutTotal","type":"uint72"},{"internalType":"uint72","name":"dayStakeSharesTotal","type":"uint72"},{"internalType":"uint56","name":"dayUnclaimedSatoshisTotal","type":"uint56"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"uint256","name":"beginDay","type":"uint256"},{"internalType":"uint256","name":"endDay","type":"uint256"}],"name":"dailyDataRange","outputs":[{"internalType":"uint256[]","name":"list","type":"uint256[]"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"uint256","name":"beforeDay","type":"uint256"}],"name":"dailyDataUpdate","outputs":[],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[],"name":"decimals","outputs":[{"internalType":"uint8","name":"","type":"uint8"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"spender","type":"address"},{"internalType":"uint256","name":"subtractedValue","type":"uint256"}],"name":"decreaseAllowance","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[],"name":"globalInfo","outputs":[{"internalType":"uint256[13]","name":"","type":"uint256[13]"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[],"name":"globals","outputs":[{"internalType":"uint72","name":"lockedHeartsTotal","type":"uint72"},{"internalType":"uint72","name":"nextStakeSharesTotal","type":"uint72"},{"internalType":"uint40","name":"shareRate","type":"uint40"},{"internalType":"uint72","name":"stakePenaltyTotal","type":"uint72"},{"internalType":"uint16","name":"dailyDataCount","type":"uint16"},{"internalType":"uint72","name":"stakeSharesTotal","type":"uint72"},{"internalType":"uint40","name":"latestStakeId","type":"uint40"},{"internalType":"uint128","name":"claimStats","type":"uint128"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"spender","type":"address"},{"internalType":"uint256","name":"addedValue","type":"uint256"}],"name":"increaseAllowance","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"internalType":"bytes32","name":"merkleLeaf","type":"bytes32"},{"internalType":"bytes32[]","name":"proof","type":"bytes32[]"}],"name":"merkleProofIsValid","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"pure","type":"function"},{"constant":true,"inputs":[],"name":"name","outputs":[{"internalType":"string","name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"bytes32","name":"pubKeyX","type":"bytes32"},{"internalType":"bytes32","name":"pubKeyY","type":"bytes32"},{"internalType":"uint8","name":"claimFlags","type":"uint8"}],"name":"pubKeyToBtcAddress","outputs":[{"internalType":"bytes20","name":"","type":"bytes20"}],"payable":false,"stateMutability":"pure","type":"function"},{"constant":true,"inputs":[{"internalType":"bytes32","name":"pubKeyX","type":"bytes32"},{"internalType":"bytes32","name":"pubKeyY","type":"bytes32"}],"name":"pubKeyToEthAddress","outputs":[{"internalType":"address","name":"","type":"address"}],"payable":false,"stateMutability":"pure","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"stakerAddr","type":"address"}],"name":"stakeCount","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"uint256","name":"stakeIndex","type":"uint256"},{"internalType":"uint40","name":"stakeIdParam","type":"uint40"}],"name":"stakeEnd","outputs":[],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"stakerAddr","type":"address"},{"internalType":"uint256","name":"stakeIndex","type":"uint256"},{"internalType":"uint40","name":"stakeIdParam","type":"uint40"}],"name":"stakeGoodAccounting","outputs":[],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"","type":"address"},{"internalType":"uint256","name":"","type":"uint256"}],"name":"stakeLists","outputs":[{"internalType":"uint40","name":"stakeId","type":"uint40"},{"internalType":"uint72","name":"stakedHearts","type":"uint72"},{"internalType":"uint72","name":"stakeShares","type":"uint72"},{"internalType":"uint16","name":"lockedDay","type":"uint16"},{"internalType":"uint16","name":"stakedDays","type":"uint16"},{"internalType":"uint16","name":"unlockedDay","type":"uint16"},{"internalType":"bool","name":"isAutoStake","type":"bool"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"uint256","name":"newStakedHearts","type":"uint256"},{"internalType":"uint256","name":"newStakedDays","type":"uint256"}],"name":"stakeStart","outputs":[],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[],"name":"symbol","outputs":[{"internalType":"string","name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[],"name":"totalSupply","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"recipient","type":"address"},{"internalType":"uint256","name":"amount","type":"uint256"}],"name":"transfer","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"sender","type":"address"},{"internalType":"address","name":"recipient","type":"address"},{"internalType":"uint256","name":"amount","type":"uint256"}],"name":"transferFrom","outputs":[{"internalType":"bool","name":"","type":"bool"}],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"internalType":"uint256","name":"","type":"uint256"}],"name":"xfLobby","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"address","name":"referrerAddr","type":"address"}],"name":"xfLobbyEnter","outputs":[],"payable":true,"stateMutability":"payable","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"memberAddr","type":"address"},{"internalType":"uint256","name":"entryId","type":"uint256"}],"name":"xfLobbyEntry","outputs":[{"internalType":"uint256","name":"rawAmount","type":"uint256"},{"internalType":"address","name":"referrerAddr","type":"address"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":false,"inputs":[{"internalType":"uint256","name":"enterDay","type":"uint256"},{"internalType":"uint256","name":"count","type":"uint256"}],"name":"xfLobbyExit","outputs":[],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":false,"inputs":[],"name":"xfLobbyFlush","outputs":[],"payable":false,"stateMutability":"nonpayable","type":"function"},{"constant":true,"inputs":[{"internalType":"uint256","name":"","type":"uint256"},{"internalType":"address","name":"","type":"address"}],"name":"xfLobbyMembers","outputs":[{"internalType":"uint40","name":"headIndex","type":"uint40"},{"internalType":"uint40","name":"tailIndex","type":"uint40"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"address","name":"memberAddr","type":"address"}],"name":"xfLobbyPendingDays","outputs":[{"internalType":"uint256[2]","name":"words","type":"uint256[2]"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[{"internalType":"uint256","name":"beginDay","type":"uint256"},{"internalType":"uint256","name":"endDay","type":"uint256"}],"name":"xfLobbyRange","outputs":[{"internalType":"uint256[]","name":"list","type":"uint256[]"}],"payable":false,"stateMutability":"view","type":"function"}]"""
+	# views read through create_read_batch and indexed events of the contract ABI, kept as python objects to
+	# skip parsing the full JSON ABI
+	ABI = [
+		{"anonymous": False, "inputs": [{"indexed": False, "internalType": "uint256", "name": "data0", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "updaterAddr", "type": "address"}], "name": "DailyDataUpdate", "type": "event"},
+		{"anonymous": False, "inputs": [{"indexed": False, "internalType": "uint256", "name": "data0", "type": "uint256"}, {"indexed": False, "internalType": "uint256", "name": "data1", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "stakerAddr", "type": "address"}, {"indexed": True, "internalType": "uint40", "name": "stakeId", "type": "uint40"}], "name": "StakeEnd", "type": "event"},
+		{"anonymous": False, "inputs": [{"indexed": False, "internalType": "uint256", "name": "data0", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "stakerAddr", "type": "address"}, {"indexed": True, "internalType": "uint40", "name": "stakeId", "type": "uint40"}], "name": "StakeStart", "type": "event"},
+		{"anonymous": False, "inputs": [{"indexed": False, "internalType": "uint256", "name": "data0", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "memberAddr", "type": "address"}, {"indexed": True, "internalType": "uint256", "name": "entryId", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "referrerAddr", "type": "address"}], "name": "XfLobbyEnter", "type": "event"},
+		{"anonymous": False, "inputs": [{"indexed": False, "internalType": "uint256", "name": "data0", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "memberAddr", "type": "address"}, {"indexed": True, "internalType": "uint256", "name": "entryId", "type": "uint256"}, {"indexed": True, "internalType": "address", "name": "referrerAddr", "type": "address"}], "name": "XfLobbyExit", "type": "event"},
+		{"constant": True, "inputs": [], "name": "currentDay", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "payable": False, "stateMutability": "view", "type": "function"},
+		{"constant": True, "inputs": [{"internalType": "uint256", "name": "beginDay", "type": "uint256"}, {"internalType": "uint256", "name": "endDay", "type": "uint256"}], "name": "dailyDataRange", "outputs": [{"internalType": "uint256[]", "name": "list", "type": "uint256[]"}], "payable": False, "stateMutability": "view", "type": "function"},
+		{"constant": True, "inputs": [], "name": "globalInfo", "outputs": [{"internalType": "uint256[13]", "name": "", "type": "uint256[13]"}], "payable": False, "stateMutability": "view", "type": "function"},
+		{"constant": True, "inputs": [], "name": "globals", "outputs": [{"internalType": "uint72", "name": "lockedHeartsTotal", "type": "uint72"}, {"internalType": "uint72", "name": "nextStakeSharesTotal", "type": "uint72"}, {"internalType": "uint40", "name": "shareRate", "type": "uint40"}, {"internalType": "uint72", "name": "stakePenaltyTotal", "type": "uint72"}, {"internalType": "uint16", "name": "dailyDataCount", "type": "uint16"}, {"internalType": "uint72", "name": "stakeSharesTotal", "type": "uint72"}, {"internalType": "uint40", "name": "latestStakeId", "type": "uint40"}, {"internalType": "uint128", "name": "claimStats", "type": "uint128"}], "payable": False, "stateMutability": "view", "type": "function"},
+		{"constant": True, "inputs": [{"internalType": "address", "name": "stakerAddr", "type": "address"}], "name": "stakeCount", "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}], "payable": False, "stateMutability": "view", "type": "function"},
+		{"constant": True, "inputs": [{"internalType": "address", "name": "", "type": "address"}, {"internalType": "uint256", "name": "", "type": "uint256"}], "name": "stakeLists", "outputs": [{"internalType": "uint40", "name": "stakeId", "type": "uint40"}, {"internalType": "uint72", "name": "stakedHearts", "type": "uint72"}, {"internalType": "uint72", "name": "stakeShares", "type": "uint72"}, {"internalType": "uint16", "name": "lockedDay", "type": "uint16"}, {"internalType": "uint16", "name": "stakedDays", "type": "uint16"}, {"internalType": "uint16", "name": "unlockedDay", "type": "uint16"}, {"internalType": "bool", "name": "isAutoStake", "type": "bool"}], "payable": False, "stateMutability": "view", "type": "function"},
+		{"constant": True, "inputs": [{"internalType": "uint256", "name": "beginDay", "type": "uint256"}, {"internalType": "uint256", "name": "endDay", "type": "uint256"}], "name": "xfLobbyRange", "outputs": [{"internalType": "uint256[]", "name": "list", "type": "uint256[]"}], "payable": False, "stateMutability": "view", "type": "function"},
+	]
 	WEI_per_ETH = 1e18
 	HEART_per_HEX = 1e8
+	# currentDay() is the number of days since the launch, computed from the block timestamp
+	LAUNCH_TIME = 1575331200
+	SECONDS_PER_DAY = 86400
+	# block timestamps trail the local clock: days are only expected from the clock after this margin
+	DAY_ROLLOVER_MARGIN_SECONDS = 600
+	# adoption amplifier lobbies only exist until this day
+	CLAIM_PHASE_END_DAY = 351
+	LOBBY_HISTORY_FILE = "lobby_history.bin"
+	# default number of smallest historical lobbies kept in snapshots
+	SNAPSHOT_LOWEST_LOBBY_SIZES = 10
+
+	def __init__(self, lobby_history_path=LOBBY_HISTORY_FILE, load_snapshot=True, w3=None, provider_uri=None,
+				 snapshot_lowest_lobby_sizes=SNAPSHOT_LOWEST_LOBBY_SIZES):
+		# web3 is only imported and set up on first use: provider_uri defaults to the web3 auto infura provider
+		self.provider_uri = provider_uri
+		self._w3 = w3
+		self._contract = None
+		self._multicall = None
+		self._connect_lock = Lock()
+		self.lobby_history = LobbyHistory(lobby_history_path)
+		self.snapshot_lowest_lobby_sizes = snapshot_lowest_lobby_sizes
+		self.snapshot = None
+		self._refresh_lock = Lock()
+		if load_snapshot:
+			self.refresh_data()
+
+	@property
+	def w3(self):
+		self._connect()
+		return self._w3
+
+	@property
+	def contract(self):
+		self._connect()
+		return self._contract
+
+	def _connect(self):
+		if self._contract is not None:
+			return
+		with self._connect_lock:
+			if self._contract is None:
+				if self._w3 is None:
+					self._w3 = HexInfo._create_w3(self.provider_uri)
+				self._multicall = ContractReadBatch.create_multicall_contract(self._w3)
+				self._contract = self._w3.eth.contract(address=HexInfo.ADDRESS, abi=HexInfo.ABI)
+
+	@staticmethod
+	def _create_w3(provider_uri):
+		from web3 import Web3, HTTPProvider
+		if provider_uri is None:
+			# own instance on the auto infura provider: the shared web3.auto w3 middlewares are left untouched
+			from web3.auto.infura import w3 as auto_w3
+			w3 = Web3(auto_w3.provider)
+		else:
+			w3 = Web3(HTTPProvider(provider_uri))
+		# requests are only eth_call and eth_getLogs: skip the eth_chainId request
+		# the validation middleware sends before each of them
+		if "validation" in w3.middleware_onion:
+			w3.middleware_onion.remove("validation")
+		return w3
 
-	def __init__(self):
-		from web3.auto.infura import w3
-		self.contract = w3.eth.contract(address=HexInfo.ADDRESS, abi=HexInfo.ABI)
-		self.refresh_data()
-
-	def get_stacked_ratio(self):
-		return self.stacked_hearts / self.total_supply
-	
-	def get_current_day_lobby_eth_size(self):
-		return HexInfo.wei_to_eth(self.current_day_lobby_size)
-		
-	def get_lowest_historical_lobbies_sizes(self, count):
-		return self.sorted_lobby_sizes_history[:count]
-		
-	def is_lowest_lobby_size(self):
-		return self.sorted_lobby_sizes_history[0] > self.current_day_lobby_size
-		
-	def is_in_lowest_lobby_sizes(self,count):
-		return self.sorted_lobby_sizes_history[count] > self.current_day_lobby_size
-		
 	def refresh_data(self):
+		self.snapshot = self.fetch_snapshot()
+		return self.snapshot
+
+	async def refresh_data_async(self, async_w3):
+		self.snapshot = await self.fetch_snapshot_async(async_w3)
+		return self.snapshot
+
+	def fetch_snapshot(self):
+		with self._refresh_lock:
+			reads = self._read_snapshot()
+			try:
+				batch, block_identifier = next(reads)
+				while True:
+					batch, block_identifier = reads.send(batch.execute(block_identifier))
+			except StopIteration as result:
+				return result.value
+
+	async def fetch_snapshot_async(self, async_w3):
+		# callers are expected to never run concurrent async refreshes (see AsyncSnapshotCache)
+		reads = self._read_snapshot()
+		try:
+			batch, block_identifier = next(reads)
+			while True:
+				batch, block_identifier = reads.send(await batch.execute_async(async_w3, block_identifier))
+		except StopIteration as result:
+			return result.value
+
+	def _read_snapshot(self):
+		# yields the (batch, block identifier) to execute and receives their results, returns the snapshot
 		# global info:
 		# return [
 				# // 1
@@ -44,15 +136,47 @@ class HexInfo:
 				# totalSupply(),
 				# xfLobby[_currentDay()]
 			# ];
-		self.today_global_info = self.contract.caller.globalInfo()
-		
-		self.circulating_supply = self.today_global_info[-2]
-		self.stacked_hearts = self.today_global_info[0]
-		self.total_supply = self.stacked_hearts + self.circulating_supply
-		self.current_day = self.contract.caller.currentDay()
-		self.current_day_lobby_size = self.today_global_info[-1] # xfLobby[_currentDay()]
-		self.lobby_size_history = self.contract.caller.xfLobbyRange(0, self.current_day)
-		self.sorted_lobby_sizes_history = sorted(self.lobby_size_history)
+		# all reads are done in a single call at a single block
+		batch = self.create_read_batch().add("globalInfo").add("currentDay")
+		# missing closed lobbies are read in the same call, up to the current day told by the clock
+		# (a range past the contract current day would revert the whole call)
+		known_day = self.snapshot.current_day if self.snapshot is not None else 0
+		known_day = max(known_day, HexInfo.get_expected_current_day())
+		history_end = self._get_missing_lobby_history_end(known_day)
+		if history_end is not None:
+			batch.add("xfLobbyRange", len(self.lobby_history), history_end)
+		block_number, results = yield batch, "latest"
+		global_info, current_day = results[0], results[1]
+		if history_end is not None:
+			self.lobby_history.append(results[2])
+		# on day rollover, fetch the newly closed lobbies at the same block
+		history_end = self._get_missing_lobby_history_end(current_day)
+		if history_end is not None:
+			_, results = yield self.create_read_batch().add("xfLobbyRange", len(self.lobby_history), history_end), \
+				block_number
+			self.lobby_history.append(results[0])
+		return HexSnapshot(
+			block_number=block_number,
+			current_day=current_day,
+			current_day_lobby_size=global_info[-1], # xfLobby[_currentDay()]
+			circulating_supply=global_info[-2],
+			stacked_hearts=global_info[0],
+			lowest_lobby_sizes=self.lobby_history.sorted_sizes[:self.snapshot_lowest_lobby_sizes]
+		)
+
+	def create_read_batch(self):
+		self._connect()
+		return ContractReadBatch(self._w3, self._contract, self._multicall)
+
+	def _get_missing_lobby_history_end(self, current_day):
+		# past lobbies never change: only fetch the days that are not stored yet
+		last_closed_day = min(current_day, HexInfo.CLAIM_PHASE_END_DAY)
+		return last_closed_day if len(self.lobby_history) < last_closed_day else None
+
+	@staticmethod
+	def get_expected_current_day():
+		return max(0, int(time.time() - HexInfo.DAY_ROLLOVER_MARGIN_SECONDS - HexInfo.LAUNCH_TIME)
+				   // HexInfo.SECONDS_PER_DAY)
 
 	@staticmethod
 	def heart_to_hex(amount):
@@ -0,0 +1,180 @@
+import time
+import asyncio
+from threading import Lock, Event, Thread
+
+from metrics import METRICS
+
+
+class HexSnapshot:
+	# immutable view of the contract state at a given block, safe to share between threads
+	__slots__ = ("block_number", "current_day", "current_day_lobby_size", "circulating_supply",
+				 "stacked_hearts", "total_supply", "lowest_lobby_sizes", "_rendered", "_render_lock")
+
+	def __init__(self, block_number, current_day, current_day_lobby_size, circulating_supply, stacked_hearts,
+				 lowest_lobby_sizes):
+		set_attribute = super().__setattr__
+		set_attribute("block_number", block_number)
+		set_attribute("current_day", current_day)
+		set_attribute("current_day_lobby_size", current_day_lobby_size)
+		set_attribute("circulating_supply", circulating_supply)
+		set_attribute("stacked_hearts", stacked_hearts)
+		set_attribute("total_supply", stacked_hearts + circulating_supply)
+		set_attribute("lowest_lobby_sizes", tuple(lowest_lobby_sizes))
+		set_attribute("_rendered", {})
+		set_attribute("_render_lock", Lock())
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+	def __delattr__(self, name):
+		raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+	def get_stacked_ratio(self):
+		return self.stacked_hearts / self.total_supply
+
+	def get_lowest_historical_lobbies_sizes(self, count):
+		return self.lowest_lobby_sizes[:count]
+
+	def is_lowest_lobby_size(self):
+		return self.is_in_lowest_lobby_sizes(0)
+
+	def is_in_lowest_lobby_sizes(self, count):
+		# snapshots only keep the smallest sizes they are created with: not enough history to compare is not a match
+		if count >= len(self.lowest_lobby_sizes):
+			return False
+		return self.lowest_lobby_sizes[count] > self.current_day_lobby_size
+
+	def get_rendered(self, key, render):
+		# messages only depend on the snapshot content: render them once per snapshot
+		with self._render_lock:
+			if key not in self._rendered:
+				METRICS.increment("hex_render_cache_total", {"message": key, "result": "miss"})
+				with METRICS.time("hex_render_seconds", {"message": key}):
+					self._rendered[key] = render(self)
+			else:
+				METRICS.increment("hex_render_cache_total", {"message": key, "result": "hit"})
+			return self._rendered[key]
+
+
+class SnapshotCache:
+	def __init__(self, fetch, ttl, max_staleness, snapshot=None):
+		self.fetch = fetch
+		self.ttl = ttl
+		self.max_staleness = max_staleness
+		self._snapshot = snapshot
+		self._fetched_at = time.time() if snapshot is not None else 0
+		self._lock = Lock()
+		self._refresh = None
+
+	def get(self):
+		with self._lock:
+			snapshot = self._snapshot
+			age = time.time() - self._fetched_at
+		if snapshot is not None and age < self.ttl:
+			METRICS.increment("hex_snapshot_cache_total", {"result": "fresh"})
+			return snapshot
+		if snapshot is not None and age < self.ttl + self.max_staleness:
+			# serve the current snapshot while a new one is fetched
+			METRICS.increment("hex_snapshot_cache_total", {"result": "stale"})
+			self._refresh_in_background()
+			return snapshot
+		METRICS.increment("hex_snapshot_cache_total", {"result": "miss"})
+		return self.refresh()
+
+	def refresh(self):
+		refresh, is_owner = self._join_refresh()
+		if is_owner:
+			self._run_refresh(refresh)
+		refresh.done.wait()
+		if refresh.error is not None:
+			raise refresh.error
+		return refresh.snapshot
+
+	def _refresh_in_background(self):
+		refresh, is_owner = self._join_refresh()
+		if is_owner:
+			Thread(target=self._run_refresh, args=(refresh,), daemon=True).start()
+
+	def _join_refresh(self):
+		# only one refresh at a time: concurrent callers wait for the running one
+		with self._lock:
+			if self._refresh is None:
+				self._refresh = _PendingRefresh()
+				return self._refresh, True
+			return self._refresh, False
+
+	def _run_refresh(self, refresh):
+		try:
+			with METRICS.time("hex_snapshot_refresh_seconds"):
+				refresh.snapshot = self._store(self.fetch())
+		except Exception as e:
+			METRICS.increment("hex_snapshot_refresh_errors_total")
+			print(f"Error: failed to refresh Hex info: {e}")
+			refresh.error = e
+		finally:
+			with self._lock:
+				self._refresh = None
+			refresh.done.set()
+
+	def _store(self, snapshot):
+		with self._lock:
+			if self._snapshot is not None and self._snapshot.block_number == snapshot.block_number:
+				# same block: keep the previous snapshot and its rendered messages
+				snapshot = self._snapshot
+			self._snapshot = snapshot
+			self._fetched_at = time.time()
+		return snapshot
+
+
+class AsyncSnapshotCache(SnapshotCache):
+	# same policy as SnapshotCache for a coroutine fetch function, to be used from a single event loop
+
+	async def get(self):
+		snapshot = self._snapshot
+		age = time.time() - self._fetched_at
+		if snapshot is not None and age < self.ttl:
+			METRICS.increment("hex_snapshot_cache_total", {"result": "fresh"})
+			return snapshot
+		if snapshot is not None and age < self.ttl + self.max_staleness:
+			METRICS.increment("hex_snapshot_cache_total", {"result": "stale"})
+			self._refresh_in_background()
+			return snapshot
+		METRICS.increment("hex_snapshot_cache_total", {"result": "miss"})
+		return await self.refresh()
+
+	async def refresh(self):
+		# shield the shared refresh: a cancelled caller should not cancel it for the others
+		return await asyncio.shield(self._join_refresh())
+
+	def _refresh_in_background(self):
+		self._join_refresh().add_done_callback(AsyncSnapshotCache._ignore_result)
+
+	def _join_refresh(self):
+		if self._refresh is None:
+			self._refresh = asyncio.ensure_future(self._run_refresh())
+		return self._refresh
+
+	async def _run_refresh(self):
+		try:
+			with METRICS.time("hex_snapshot_refresh_seconds"):
+				return self._store(await self.fetch())
+		except Exception as e:
+			METRICS.increment("hex_snapshot_refresh_errors_total")
+			print(f"Error: failed to refresh Hex info: {e}")
+			raise
+		finally:
+			self._refresh = None
+
+	@staticmethod
+	def _ignore_result(refresh):
+		if not refresh.cancelled():
+			refresh.exception()
+
+
+class _PendingRefresh:
+	__slots__ = ("done", "snapshot", "error")
+
+	def __init__(self):
+		self.done = Event()
+		self.snapshot = None
+		self.error = None
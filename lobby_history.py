@@ -0,0 +1,52 @@
+import os
+import mmap
+from bisect import insort
+
+
+class LobbyHistory:
+	# each day is stored as a fixed width little endian unsigned integer (wei), in day order
+	RECORD_SIZE = 16
+	BYTE_ORDER = "little"
+
+	def __init__(self, path):
+		self.path = path
+		self.sizes = []
+		self.sorted_sizes = []
+		self._load()
+
+	def __len__(self):
+		return len(self.sizes)
+
+	def append(self, new_sizes):
+		if not new_sizes:
+			return
+		with open(self.path, "ab") as history_file:
+			history_file.write(b"".join(LobbyHistory._to_record(size) for size in new_sizes))
+			history_file.flush()
+			os.fsync(history_file.fileno())
+		for size in new_sizes:
+			self.sizes.append(size)
+			insort(self.sorted_sizes, size)
+
+	def _load(self):
+		if not os.path.isfile(self.path):
+			return
+		with open(self.path, "r+b") as history_file:
+			file_size = os.fstat(history_file.fileno()).st_size
+			complete_size = file_size - file_size % LobbyHistory.RECORD_SIZE
+			if complete_size != file_size:
+				# drop a record partially written before a crash, it will be fetched again
+				print(f"Warning: truncating incomplete lobby history record in {self.path}")
+				history_file.truncate(complete_size)
+			if complete_size == 0:
+				return
+			with mmap.mmap(history_file.fileno(), complete_size, access=mmap.ACCESS_READ) as records:
+				self.sizes = [
+					int.from_bytes(records[offset:offset + LobbyHistory.RECORD_SIZE], LobbyHistory.BYTE_ORDER)
+					for offset in range(0, complete_size, LobbyHistory.RECORD_SIZE)
+				]
+		self.sorted_sizes = sorted(self.sizes)
+
+	@staticmethod
+	def _to_record(size):
+		return size.to_bytes(LobbyHistory.RECORD_SIZE, LobbyHistory.BYTE_ORDER)
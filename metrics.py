@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+from threading import Lock, Thread, get_ident
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+	__slots__ = ("buckets", "bucket_counts", "count", "sum")
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.bucket_counts = [0] * len(buckets)
+		self.count = 0
+		self.sum = 0
+
+	def observe(self, value):
+		self.count += 1
+		self.sum += value
+		for index, bucket in enumerate(self.buckets):
+			if value <= bucket:
+				self.bucket_counts[index] += 1
+				break
+
+	def get_quantile(self, quantile):
+		# upper bound of the bucket containing the quantile
+		rank = quantile * self.count
+		cumulated_count = 0
+		for bucket, bucket_count in zip(self.buckets, self.bucket_counts):
+			cumulated_count += bucket_count
+			if cumulated_count >= rank:
+				return bucket
+		return float("inf")
+
+
+class MetricsRegistry:
+	def __init__(self):
+		self._counters = {}
+		self._histograms = {}
+		# timed sections each thread is in, innermost last, see SamplingProfiler
+		self._active_sections = {}
+		self._lock = Lock()
+
+	def increment(self, name, labels=None, amount=1):
+		key = MetricsRegistry._get_key(name, labels)
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0) + amount
+
+	def observe(self, name, value, labels=None, buckets=TIME_BUCKETS):
+		key = MetricsRegistry._get_key(name, labels)
+		with self._lock:
+			if key not in self._histograms:
+				self._histograms[key] = Histogram(buckets)
+			self._histograms[key].observe(value)
+
+	@contextmanager
+	def time(self, name, labels=None):
+		started_at = time.perf_counter()
+		try:
+			with self.section(name):
+				yield
+		finally:
+			self.observe(name, time.perf_counter() - started_at, labels)
+
+	@contextmanager
+	def section(self, name):
+		# marks the current thread as working on name without measuring it
+		thread_id = get_ident()
+		with self._lock:
+			self._active_sections.setdefault(thread_id, []).append(name)
+		try:
+			yield
+		finally:
+			with self._lock:
+				sections = self._active_sections[thread_id]
+				# coroutines of an event loop can leave their sections in any order
+				del sections[len(sections) - 1 - sections[::-1].index(name)]
+				if not sections:
+					del self._active_sections[thread_id]
+
+	def get_active_sections(self):
+		# innermost timed section of every thread inside one
+		with self._lock:
+			return {thread_id: sections[-1] for thread_id, sections in self._active_sections.items()}
+
+	def render_prometheus(self):
+		lines = []
+		with self._lock:
+			for name in sorted({name for name, _ in self._counters}):
+				lines.append(f"# TYPE {name} counter")
+				for (counter_name, labels), value in sorted(self._counters.items()):
+					if counter_name == name:
+						lines.append(f"{name}{MetricsRegistry._format_labels(labels)} {value}")
+			for name in sorted({name for name, _ in self._histograms}):
+				lines.append(f"# TYPE {name} histogram")
+				for (histogram_name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+					if histogram_name != name:
+						continue
+					cumulated_count = 0
+					for bucket, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+						cumulated_count += bucket_count
+						lines.append(f"{name}_bucket{MetricsRegistry._format_labels(labels + (('le', bucket),))} "
+									 f"{cumulated_count}")
+					lines.append(f"{name}_bucket{MetricsRegistry._format_labels(labels + (('le', '+Inf'),))} "
+								 f"{histogram.count}")
+					lines.append(f"{name}_sum{MetricsRegistry._format_labels(labels)} {histogram.sum}")
+					lines.append(f"{name}_count{MetricsRegistry._format_labels(labels)} {histogram.count}")
+		return "\n".join(lines) + "\n"
+
+	def render_summary(self):
+		lines = []
+		with self._lock:
+			for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+				lines.append(f"{name}{MetricsRegistry._format_labels(labels)}: {histogram.count} | "
+							 f"avg {round(histogram.sum / histogram.count, 4)} | "
+							 f"p50 <= {histogram.get_quantile(0.5)} | p99 <= {histogram.get_quantile(0.99)}")
+			for (name, labels), value in sorted(self._counters.items()):
+				lines.append(f"{name}{MetricsRegistry._format_labels(labels)}: {value}")
+		return "\n".join(lines)
+
+	@staticmethod
+	def _get_key(name, labels):
+		return name, tuple(sorted((key, str(value)) for key, value in labels.items())) if labels else ()
+
+	@staticmethod
+	def _format_labels(labels):
+		if not labels:
+			return ""
+		return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+METRICS = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		content = METRICS.render_prometheus().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def log_message(self, *_):
+		pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+	# serves METRICS in the Prometheus text format on http://host:port/metrics
+	server = ThreadingHTTPServer((host, port), _MetricsHandler)
+	server.daemon_threads = True
+	Thread(target=server.serve_forever, daemon=True).start()
+	print(f"Serving metrics on http://{host}:{port}/metrics")
+	return server
+
+
+class SamplingProfiler:
+	# periodically records where threads working in a timed section are, to find where the time goes
+	# without a tracing profiler
+	SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+	# threads parked in these (file, function) are waiting for another thread or for the event loop to get i/o
+	WAITING_FUNCTIONS = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get")}
+
+	def __init__(self, interval):
+		self.interval = interval
+		self.samples = Counter()
+		self.sample_count = 0
+		self._lock = Lock()
+		self._running = False
+		self._thread = None
+
+	def start(self):
+		self._running = True
+		self._thread = Thread(target=self._run, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+
+	def get_top_locations(self, count):
+		with self._lock:
+			return self.samples.most_common(count)
+
+	def _run(self):
+		own_thread_id = self._thread.ident
+		while self._running:
+			active_sections = METRICS.get_active_sections()
+			with self._lock:
+				for thread_id, frame in sys._current_frames().items():
+					section = active_sections.get(thread_id)
+					# idle threads (pollers, schedulers, pool workers) would hide where the work goes
+					if thread_id == own_thread_id or section is None or SamplingProfiler._is_waiting(frame):
+						continue
+					self.samples[f"{section} {SamplingProfiler._get_location(frame)}"] += 1
+				self.sample_count += 1
+			time.sleep(self.interval)
+
+	@staticmethod
+	def _is_waiting(frame):
+		return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in SamplingProfiler.WAITING_FUNCTIONS
+
+	@staticmethod
+	def _get_location(frame):
+		# innermost line of this project, libraries waiting on the network are accounted to their caller
+		leaf = frame
+		while frame is not None and not frame.f_code.co_filename.startswith(SamplingProfiler.SOURCE_DIRECTORY):
+			frame = frame.f_back
+		frame = frame or leaf
+		return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
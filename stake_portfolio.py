@@ -0,0 +1,82 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StakeRecord:
+	__slots__ = ("stake_id", "staked_hearts", "stake_shares", "locked_day", "staked_days", "unlocked_day")
+
+	def __init__(self, stake_id, staked_hearts, stake_shares, locked_day, staked_days, unlocked_day):
+		self.stake_id = stake_id
+		self.staked_hearts = staked_hearts
+		self.stake_shares = stake_shares
+		self.locked_day = locked_day
+		self.staked_days = staked_days
+		self.unlocked_day = unlocked_day
+
+	def get_end_day(self):
+		return self.locked_day + self.staked_days
+
+
+class StakePortfolioFetcher:
+	# stakeLists calls per aggregated call
+	MAX_CALLS_PER_BATCH = 300
+	MAX_PARALLEL_BATCHES = 4
+
+	def __init__(self, hex_info):
+		self.hex_info = hex_info
+
+	def get_stakes(self, address):
+		return next(iter(self.get_portfolios([address]).values()))
+
+	def get_portfolios(self, addresses):
+		# 1 call for every stake count, then stakes in parallel batches, all read at the same block
+		# portfolios are returned by checksum address
+		addresses = StakePortfolioFetcher._get_checksum_addresses(addresses)
+		block_number, counts = self._create_stake_count_batch(addresses).execute()
+		batches = self._create_stake_batches(addresses, counts)
+		with ThreadPoolExecutor(max_workers=StakePortfolioFetcher.MAX_PARALLEL_BATCHES) as executor:
+			results = list(executor.map(lambda batch: batch.execute(block_number)[1], batches))
+		return self._build_portfolios(addresses, batches, results)
+
+	async def get_stakes_async(self, address, async_w3):
+		return next(iter((await self.get_portfolios_async([address], async_w3)).values()))
+
+	async def get_portfolios_async(self, addresses, async_w3):
+		addresses = StakePortfolioFetcher._get_checksum_addresses(addresses)
+		block_number, counts = await self._create_stake_count_batch(addresses).execute_async(async_w3)
+		batches = self._create_stake_batches(addresses, counts)
+		results = await asyncio.gather(*(batch.execute_async(async_w3, block_number) for batch in batches))
+		return self._build_portfolios(addresses, batches, [stakes for _, stakes in results])
+
+	@staticmethod
+	def _get_checksum_addresses(addresses):
+		from web3 import Web3
+		return list(dict.fromkeys(Web3.toChecksumAddress(address) for address in addresses))
+
+	def _create_stake_count_batch(self, addresses):
+		batch = self.hex_info.create_read_batch()
+		for address in addresses:
+			batch.add("stakeCount", address)
+		return batch
+
+	def _create_stake_batches(self, addresses, counts):
+		calls = [(address, index) for address, count in zip(addresses, counts) for index in range(count)]
+		batches = []
+		for start in range(0, len(calls), StakePortfolioFetcher.MAX_CALLS_PER_BATCH):
+			batch = self.hex_info.create_read_batch()
+			for address, index in calls[start:start + StakePortfolioFetcher.MAX_CALLS_PER_BATCH]:
+				batch.add("stakeLists", address, index)
+			batches.append(batch)
+		return batches
+
+	def _build_portfolios(self, addresses, batches, results):
+		portfolios = {address: [] for address in addresses}
+		for batch, stakes in zip(batches, results):
+			for (_, (address, _)), stake in zip(batch.calls, stakes):
+				portfolios[address].append(StakePortfolioFetcher._get_stake_record(stake))
+		return portfolios
+
+	@staticmethod
+	def _get_stake_record(stake):
+		stake_id, staked_hearts, stake_shares, locked_day, staked_days, unlocked_day, _ = stake
+		return StakeRecord(stake_id, staked_hearts, stake_shares, locked_day, staked_days, unlocked_day)